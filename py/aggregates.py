@@ -0,0 +1,76 @@
+# First day of the current phase, loot before this is left out of the phase totals
+PHASE_START = "2024-12-07"
+
+
+def _items_by_id(items):
+    # The page used to iterate these as JS object keys, which orders numeric IDs ascending
+    return sorted(items.items(), key=lambda kv: int(kv[0]) if kv[0].isdigit() else float('inf'))
+
+
+def build_summary(raid_data, phase_start=PHASE_START):
+    """
+    Precomputes everything the overview tables on the page need, so the
+    browser does not have to walk the full history on every load.
+
+    Args:
+        raid_data: The full raid data.
+        phase_start: Loot on or after this date counts towards the totals.
+
+    Returns:
+        A dictionary with:
+            phaseStart: The cutoff used for the totals.
+            latestDate: The most recent loot date.
+            raids: {raid: sorted list of characters with loot from it}.
+            latest: {character: [{itemName, itemLink, wasSr}]} for loot on
+                    latestDate, with every character present.
+            totals: {character: {mainspec, desecratedMainspec, offspec,
+                    desecratedOffspec, mainspecItems, offspecItems}}.
+    """
+    latest_date = max((date for specs in raid_data.values() for items in specs.values()
+                       for item_data in items.values() for event in item_data['lootEvents']
+                       for date in event['dateTime']), default=None)
+
+    raids = {}
+    latest = {}
+    totals = {}
+
+    for character in sorted(raid_data):
+        specs = raid_data[character]
+        latest[character] = []
+        totals[character] = {
+            'mainspec': 0,
+            'desecratedMainspec': 0,
+            'offspec': 0,
+            'desecratedOffspec': 0,
+            'mainspecItems': [],
+            'offspecItems': [],
+        }
+
+        for spec in ('Mainspec', 'Offspec'):
+            key = spec.lower()
+            desecrated_key = f"desecrated{spec}"
+            for item_id, item_data in _items_by_id(specs.get(spec, {})):
+                item_name = item_data['itemName']
+                raids.setdefault(item_data['raid'], set()).add(character)
+                totals[character][f"{key}Items"].append(item_name)
+
+                for event in item_data['lootEvents']:
+                    if event['dateTime'][0] >= phase_start:
+                        totals[character][key] += event['timesLooted']
+                        if item_name.startswith("Desecrated"):
+                            totals[character][desecrated_key] += event['timesLooted']
+
+                if latest_date and any(latest_date in event['dateTime'] for event in item_data['lootEvents']):
+                    latest[character].append({
+                        'itemName': item_name,
+                        'itemLink': item_data['itemLink'],
+                        'wasSr': any(event.get('wasSr') for event in item_data['lootEvents']),
+                    })
+
+    return {
+        'phaseStart': phase_start,
+        'latestDate': latest_date,
+        'raids': {str(raid): sorted(characters) for raid, characters in sorted(raids.items(), key=lambda kv: str(kv[0]))},
+        'latest': latest,
+        'totals': totals,
+    }
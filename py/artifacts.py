@@ -0,0 +1,173 @@
+import glob
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+
+from aggregates import PHASE_START, build_summary
+from ftp_transfer import content_hash, load_deploy_manifest
+
+try:
+    import brotli
+except ImportError:  # Optional, only the gzip variants are written without it
+    brotli = None
+
+base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+data_dir = os.path.join(base_dir, 'data')
+
+# 11 compresses a few percent better but is several times slower
+BROTLI_QUALITY = 7
+
+
+def write_atomic(path, content):
+    """
+    Writes bytes to path via a temp file in the same directory and a rename,
+    so readers never see a partially written file.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.chmod(tmp_path, 0o644)  # mkstemp creates the file owner-only
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def load_json(path):
+    """
+    Loads a JSON file, None if it does not exist or is empty.
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            try:
+                return json.load(f)
+            except json.JSONDecodeError:  # Handle empty JSON file
+                return None
+    except FileNotFoundError:
+        return None
+
+
+def write_json_atomic(path, data, indent=None):
+    """
+    Writes data as JSON atomically. Without indent the output is minified.
+    """
+    separators = None if indent else (',', ':')
+    content = json.dumps(data, indent=indent, separators=separators, ensure_ascii=False).encode('utf-8')
+    write_atomic(path, content)
+    return content
+
+
+def _variants_deployed(path, content, deployed):
+    """
+    True if the deploy manifest lists content as the deployed version of
+    path and every compressed variant on disk is still the deployed one.
+    """
+    name = os.path.relpath(path, base_dir).replace(os.sep, '/')
+    if deployed.get(name) != hashlib.sha256(content).hexdigest():
+        return False
+    for suffix in ('.gz', '.br') if brotli is not None else ('.gz',):
+        variant = f"{path}{suffix}"
+        if not os.path.exists(variant) or deployed.get(name + suffix) != content_hash(variant):
+            return False
+    return True
+
+
+def write_compressed_variants(path, content, deployed=None):
+    """
+    Writes precompressed .gz (and .br if brotli is installed) copies of
+    content next to path. gzip's mtime is fixed so unchanged content gives
+    byte-identical files. Content that was already deployed (per deployed,
+    the deploy manifest, loaded if not given) keeps its existing variants.
+    """
+    if deployed is None:
+        deployed = load_deploy_manifest()
+    if _variants_deployed(path, content, deployed):
+        return
+    write_atomic(f"{path}.gz", gzip.compress(content, compresslevel=9, mtime=0))
+    if brotli is not None:
+        write_atomic(f"{path}.br", brotli.compress(content, quality=BROTLI_QUALITY))
+
+
+def shard_raid_data(raid_data):
+    """
+    Splits raid_data per raid, keeping the character -> spec -> item layout
+    so each shard can be rendered exactly like the full file.
+    """
+    shards = {}
+    for character, specs in raid_data.items():
+        for spec, items in specs.items():
+            for item_id, item_data in items.items():
+                shard = shards.setdefault(item_data['raid'], {})
+                shard.setdefault(character, {"Mainspec": {}, "Offspec": {}}).setdefault(spec, {})[item_id] = item_data
+    return shards
+
+
+def _publish(out_dir, path, data, manifest_entry=None, deployed=None):
+    content = write_json_atomic(path, data)
+    write_compressed_variants(path, content, deployed)
+    if manifest_entry is not None:
+        manifest_entry.update({
+            'file': os.path.relpath(path, out_dir).replace(os.sep, '/'),
+            'bytes': len(content),
+            'sha256': hashlib.sha256(content).hexdigest(),
+        })
+    return content
+
+
+def publish_artifacts(raid_data, softres_data, out_dir=data_dir, phase_start=PHASE_START):
+    """
+    Writes the frontend artifacts for raid_data and softres_data:
+    the full documents (indented, as before), minified copies, minified
+    per-raid shards under shards/, summary.min.json with the precomputed
+    overview tables (see aggregates.build_summary), and shards/manifest.json
+    listing every file. Every minified file also gets gzip and brotli variants. All files
+    are written atomically.
+
+    Args:
+        raid_data: The full raid data.
+        softres_data: The full soft reserve data.
+        out_dir: The directory to write to, data/ by default.
+        phase_start: The start of the phase the summary totals count.
+
+    Returns:
+        The manifest dictionary.
+    """
+    write_json_atomic(os.path.join(out_dir, 'raid_data.json'), raid_data, indent=4)
+    write_json_atomic(os.path.join(out_dir, 'softres_data.json'), softres_data, indent=4)
+
+    deployed = load_deploy_manifest()
+    manifest = {'raid_data': {}, 'softres_data': {}, 'summary': {}, 'raids': {}, 'softres': {}}
+    _publish(out_dir, os.path.join(out_dir, 'raid_data.min.json'), raid_data, manifest['raid_data'], deployed)
+    _publish(out_dir, os.path.join(out_dir, 'softres_data.min.json'), softres_data, manifest['softres_data'], deployed)
+    _publish(out_dir, os.path.join(out_dir, 'summary.min.json'), build_summary(raid_data, phase_start),
+             manifest['summary'], deployed)
+
+    shards_path = os.path.join(out_dir, 'shards')
+    for raid, shard in sorted(shard_raid_data(raid_data).items(), key=lambda kv: str(kv[0])):
+        entry = manifest['raids'][str(raid)] = {'characters': sorted(shard)}
+        _publish(out_dir, os.path.join(shards_path, f"raid_{raid}.min.json"), shard, entry, deployed)
+
+    for raid_instance in sorted(softres_data):
+        entry = manifest['softres'][raid_instance] = {}
+        _publish(out_dir, os.path.join(shards_path, f"softres_{raid_instance}.min.json"), softres_data[raid_instance], entry, deployed)
+
+    content = write_json_atomic(os.path.join(shards_path, 'manifest.json'), manifest, indent=2)
+    write_compressed_variants(os.path.join(shards_path, 'manifest.json'), content, deployed)
+    return manifest
+
+
+def artifact_sizes(out_dir=data_dir):
+    """
+    Returns {path relative to out_dir: bytes} for every file written by
+    publish_artifacts.
+    """
+    sizes = {}
+    for pattern in ('raid_data*.json*', 'softres_data*.json*', 'summary*.json*', os.path.join('shards', '*')):
+        for path in sorted(glob.glob(os.path.join(out_dir, pattern))):
+            sizes[os.path.relpath(path, out_dir).replace(os.sep, '/')] = os.path.getsize(path)
+    return sizes
@@ -0,0 +1,323 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from artifacts import load_json
+from pipeline import Pipeline
+from rebuild import list_backup_weeks
+from synthetic_data import boss_dict, generate_exports
+
+base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+benchmark_dir = os.path.join(base_dir, 'data', 'benchmarks')
+baseline_file = os.path.join(benchmark_dir, 'baseline.json')
+backup_dir = os.path.join(base_dir, 'data', 'backups')
+roster_file = os.path.join(base_dir, 'data', 'roster.txt')
+
+STAGES = ['sr_decode', 'loot_convert', 'merge', 'was_sr', 'write']
+
+log = logging.getLogger('benchmark')
+
+
+class StubClient:
+    """
+    Stands in for BlizzardClient so benchmarks never touch the network.
+    Every unknown item resolves to a synthetic name that matches no
+    resolution rule, so it is queued rather than written to a loot table.
+    """
+
+    cache = None
+
+    def __init__(self):
+        self.api_calls = 0
+
+    def get_item_data(self, item_id):
+        self.api_calls += 1
+        return {'id': int(item_id), 'name': f"Synthetic Item {item_id}"}
+
+    def prefetch_items(self, item_ids):
+        return {item_id: self.get_item_data(item_id) for item_id in dict.fromkeys(item_ids)}
+
+    def api_stats(self):
+        return {'calls': self.api_calls, 'errors': 0}
+
+
+class StageTimer:
+    """
+    Stands in for RunReport in Pipeline.process and adds up the stage
+    timings (and the peak traced memory when track_memory is set) over
+    all weeks.
+    """
+
+    def __init__(self, track_memory=False):
+        self.track_memory = track_memory
+        self.stages = {name: {'seconds': 0.0, 'last_week_seconds': 0.0, 'rows': 0} for name in STAGES}
+
+    @contextmanager
+    def stage(self, name):
+        if self.track_memory:
+            tracemalloc.reset_peak()
+        info = {}
+        start = time.perf_counter()
+        yield info
+        elapsed = time.perf_counter() - start
+        stage = self.stages[name]
+        stage['seconds'] += elapsed
+        stage['last_week_seconds'] = elapsed
+        stage['rows'] += info.get('rows', 0)
+        if self.track_memory:
+            peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            stage['peak_mb'] = round(max(stage.get('peak_mb', 0), peak), 2)
+
+    def set(self, key, value):
+        pass
+
+
+def run_pipeline(export_dir, work_dir, weeks, track_memory=False, engine='python', backend='json', roster=None):
+    """
+    Runs the weekly pipeline the way 'main.py run --batch' does, through
+    Pipeline.process (SR decode, loot conversion, merge and wasSr pass,
+    publish_phases), once per week in order and with a fresh Pipeline per
+    week, like one 'run' per week. A week without a loot or SR export
+    skips that export. The ledger and the pending queue are left alone.
+    engine and backend are passed to the Pipeline, the SQLite database is
+    kept in work_dir. roster defaults to export_dir/roster.txt.
+
+    Returns:
+        A tuple (stages, output_sha256) where stages maps each stage to its
+        total seconds, the seconds of the last week, rows, and the peak
+        traced memory in MB when track_memory is set.
+    """
+    roster = roster or os.path.join(export_dir, 'roster.txt')
+    raid_file = os.path.join(work_dir, 'raid_data.json')
+    softres_file = os.path.join(work_dir, 'softres_data.json')
+    client = StubClient()
+    timer = StageTimer(track_memory)
+
+    for week in weeks:
+        loot_export, softres_export = (os.path.join(export_dir, kind, week) for kind in ('Loot', 'SR'))
+        pipeline = Pipeline(work_dir, raid_file, softres_file, boss_dict, roster, backend=backend,
+                            interactive=False, engine=engine, db_path=os.path.join(work_dir, 'loot_history.db'))
+        pipeline.client = client
+        try:
+            pipeline.process(loot_export if os.path.exists(loot_export) else None,
+                             softres_export if os.path.exists(softres_export) else None, timer)
+        finally:
+            pipeline.close()
+
+    digest = hashlib.sha256()
+    for name in ('raid_data.min.json', 'softres_data.min.json'):
+        with open(os.path.join(work_dir, name), 'rb') as f:
+            digest.update(f.read())
+
+    stages = timer.stages
+    for info in stages.values():
+        info['seconds'] = round(info['seconds'], 4)
+        info['last_week_seconds'] = round(info['last_week_seconds'], 4)
+        if info['rows'] and info['seconds']:
+            info['rows_per_sec'] = round(info['rows'] / info['seconds'], 1)
+    return stages, digest.hexdigest()
+
+
+def run_benchmark(config, repeat=3, track_memory=True, engine='python'):
+    """
+    Generates the synthetic exports for config and times the pipeline,
+    keeping the fastest of repeat runs per stage. A separate run under
+    tracemalloc records the peak memory per stage. The engine is not part
+    of the config, so results of both engines for the same config can be
+    compared to check that they produce the same output.
+    """
+    export_dir = tempfile.mkdtemp(prefix='loot_bench_exports_')
+    try:
+        weeks = generate_exports(export_dir, config['roster'], config['weeks'], config['items'],
+                                 tuple(config['raids']), unknown_item_rate=config['unknown_items'],
+                                 seed=config['seed'])
+        best, totals, output_sha256 = None, [], None
+        for _ in range(repeat):
+            work_dir = tempfile.mkdtemp(prefix='loot_bench_work_')
+            try:
+                start = time.perf_counter()
+                stages, output_sha256 = run_pipeline(export_dir, work_dir, weeks, engine=engine)
+                totals.append(time.perf_counter() - start)
+            finally:
+                shutil.rmtree(work_dir)
+            if best is None:
+                best = stages
+            else:
+                for name, info in stages.items():
+                    if info['seconds'] < best[name]['seconds']:
+                        best[name] = info
+
+        if track_memory:
+            work_dir = tempfile.mkdtemp(prefix='loot_bench_work_')
+            tracemalloc.start()
+            try:
+                memory_stages, _ = run_pipeline(export_dir, work_dir, weeks, track_memory=True, engine=engine)
+                peak_mb = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2)
+            finally:
+                tracemalloc.stop()
+                shutil.rmtree(work_dir)
+            for name, info in memory_stages.items():
+                best[name]['peak_mb'] = info['peak_mb']
+        else:
+            peak_mb = None
+    finally:
+        shutil.rmtree(export_dir)
+
+    return {
+        'config': config,
+        'engine': engine,
+        'python': sys.version.split()[0],
+        'stages': best,
+        'total_seconds': round(min(totals), 4),
+        'peak_mb': peak_mb,
+        'output_sha256': output_sha256,
+    }
+
+
+def check_engines(export_dir=backup_dir, roster=roster_file):
+    """
+    Runs the weekly exports in export_dir (data/backups by default) through
+    every engine and backend and checks that they all publish the same
+    raid_data.json and softres_data.json as the python engine with the JSON
+    backend.
+
+    Returns:
+        A list of mismatch messages, empty if all outputs agree.
+    """
+    weeks = [week for week, _, _ in list_backup_weeks(export_dir)]
+    outputs = {}
+    for engine in ('python', 'pandas'):
+        for backend in ('json', 'sqlite'):
+            work_dir = tempfile.mkdtemp(prefix='loot_check_work_')
+            try:
+                run_pipeline(export_dir, work_dir, weeks, engine=engine, backend=backend, roster=roster)
+                outputs[engine, backend] = {}
+                for name in ('raid_data.json', 'softres_data.json'):
+                    with open(os.path.join(work_dir, name), 'rb') as f:
+                        outputs[engine, backend][name] = f.read()
+            finally:
+                shutil.rmtree(work_dir)
+
+    mismatches = []
+    reference = outputs['python', 'json']
+    for (engine, backend), output in outputs.items():
+        for name, content in output.items():
+            if content != reference[name]:
+                mismatches.append(f"{name} of the {engine} engine with the {backend} backend differs from "
+                                  f"the python engine with the json backend")
+    log.info(f"Checked {len(weeks)} weeks with {len(outputs)} engine/backend combinations")
+    return mismatches
+
+
+def compare_to_baseline(result, baseline, tolerance=0.25, min_delta=0.01):
+    """
+    Compares stage timings with a baseline result. A stage regresses when
+    it is more than tolerance slower and at least min_delta seconds slower.
+    A different output hash for the same config is reported as well.
+    Timings of a baseline recorded with the other engine are not
+    compared, only the output hash is.
+
+    Returns:
+        A list of regression messages, empty if there are none.
+    """
+    if baseline.get('config') != result['config']:
+        log.warning("Baseline was recorded with a different configuration, timings are not compared")
+        return []
+
+    regressions = []
+    if baseline.get('output_sha256') != result['output_sha256']:
+        regressions.append("Output differs from the baseline for the same synthetic data")
+    if baseline.get('engine', 'python') != result['engine']:
+        log.info(f"Baseline was recorded with the {baseline.get('engine', 'python')} engine, only the output is compared")
+        return regressions
+    pairs = [(name, baseline['stages'].get(name, {}).get('seconds'), info['seconds'])
+             for name, info in result['stages'].items()]
+    pairs.append(('total', baseline.get('total_seconds'), result['total_seconds']))
+    for name, before, after in pairs:
+        if not before:
+            continue
+        change = (after - before) / before
+        log.info(f"{name:<13} {before:>9.4f}s -> {after:>9.4f}s ({change:+.0%})")
+        if change > tolerance and after - before >= min_delta:
+            regressions.append(f"{name} is {change:.0%} slower than the baseline ({before:.4f}s -> {after:.4f}s)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ingestion pipeline on synthetic exports.")
+    parser.add_argument('--roster', type=int, default=40, help="Number of characters")
+    parser.add_argument('--weeks', type=int, default=12, help="Number of weeks")
+    parser.add_argument('--items', type=int, default=60, help="Loot rows per week")
+    parser.add_argument('--raids', default='Naxx,AQ', help="Comma separated raids to rotate through")
+    parser.add_argument('--unknown-items', type=float, default=0.02,
+                        help="Share of loot rows with items missing from the lookup tables (stubbed API)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per measurement, the fastest is kept")
+    parser.add_argument('--engine', choices=['python', 'pandas'], default='python',
+                        help="Convert with the streaming converters or the DataFrame path")
+    parser.add_argument('--no-memory', action='store_true', help="Skip the tracemalloc run")
+    parser.add_argument('--baseline', default=baseline_file, help="Baseline to compare with")
+    parser.add_argument('--save-baseline', action='store_true', help="Store this result as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="Allowed slowdown per stage before it counts as a regression")
+    parser.add_argument('--check-engines', action='store_true',
+                        help="Instead of timing, check that every engine and backend produce the same "
+                             "raid_data.json and softres_data.json from data/backups")
+    args = parser.parse_args()
+
+    # The converters log progress and lookup table warnings on every week, keep only this module's output
+    logging.basicConfig(level=logging.ERROR, format='%(message)s')
+    log.setLevel(logging.INFO)
+
+    if args.check_engines:
+        mismatches = check_engines()
+        for message in mismatches:
+            log.error(f"MISMATCH: {message}")
+        if mismatches:
+            sys.exit(1)
+        log.info("All engines and backends agree")
+        return
+
+    config = {'roster': args.roster, 'weeks': args.weeks, 'items': args.items, 'raids': args.raids.split(','),
+              'unknown_items': args.unknown_items, 'seed': args.seed}
+    result = run_benchmark(config, repeat=args.repeat, track_memory=not args.no_memory, engine=args.engine)
+
+    log.info(f"{'stage':<13} {'total s':>9} {'last wk s':>9} {'rows/s':>10} {'peak MB':>8}")
+    for name, info in result['stages'].items():
+        log.info(f"{name:<13} {info['seconds']:>9.4f} {info['last_week_seconds']:>9.4f} "
+                 f"{info.get('rows_per_sec', ''):>10} {info.get('peak_mb', ''):>8}")
+    log.info(f"Full pipeline: {result['total_seconds']:.4f}s, peak {result['peak_mb']} MB")
+
+    os.makedirs(benchmark_dir, exist_ok=True)
+    with open(os.path.join(benchmark_dir, 'last_run.json'), 'w', encoding='utf-8') as outfile:
+        json.dump(result, outfile, indent=2)
+        outfile.write('\n')
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as outfile:
+            json.dump(result, outfile, indent=2)
+            outfile.write('\n')
+        log.info(f"Saved baseline to {args.baseline}")
+        return
+
+    baseline = load_json(args.baseline)
+    if baseline is None:
+        log.info("No baseline yet, run with --save-baseline to record one")
+        return
+    regressions = compare_to_baseline(result, baseline, args.tolerance)
+    for message in regressions:
+        log.error(f"REGRESSION: {message}")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
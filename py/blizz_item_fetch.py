@@ -1,29 +1,297 @@
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
-from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
 
-load_dotenv()
-
+# main.py loads .env before this module is imported
 CLIENT_ID = os.getenv("CLIENT_ID")
 SECRET = os.getenv("SECRET")
 
-def get_access_token(client_id, client_secret, region='us'):
-    data = { 'grant_type': 'client_credentials' }
-    response = requests.post(f'https://{region}.battle.net/oauth/token', data=data, auth=(client_id, client_secret))
-    print(response.status_code)
-    # print(response.text)  # Print the raw response content
-    return response.json()['access_token']
-
-
-def get_item_data(access_token, item_id):
-    url = f'https://us.api.blizzard.com/data/wow/item/{item_id}'
-    headers = {
-        'Authorization': f'Bearer {access_token}'  # Use user's access token
-    }
-    params = {
-        'namespace': 'static-classic1x-us',
-        'locale': 'en_US'
-    }
-    response = requests.get(url, headers=headers, params=params)
-    # print(response.status_code)
-    return response.json()
+base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+item_cache_file = os.path.join(base_dir, 'data', 'cache', 'item_cache.json')
+
+log = logging.getLogger(__name__)
+
+# Overridable so the client can be pointed at a local stub server
+OAUTH_URL = os.getenv("BLIZZ_OAUTH_URL", "https://{region}.battle.net/oauth/token")
+API_URL = os.getenv("BLIZZ_API_URL", "https://{region}.api.blizzard.com")
+
+
+class ItemCache:
+    """
+    On-disk cache of full item payloads (name, quality, slot, icon, ...).
+    Failed or unknown lookups are stored as negative entries with a shorter
+    TTL so they are retried eventually but not on every run. When the cache
+    grows past max_entries the least recently used entries are evicted.
+    """
+
+    def __init__(self, path=item_cache_file, ttl=90 * 86400, negative_ttl=86400, max_entries=20000):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.evictions = 0
+        self._dirty = False
+        self._lock = threading.Lock()
+        self.entries = {}
+
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                try:
+                    self.entries = json.load(f)
+                except json.JSONDecodeError:
+                    log.warning(f"Error decoding {os.path.basename(path)}. Starting with an empty item cache.")
+        except FileNotFoundError:
+            pass
+
+    def lookup(self, item_id):
+        """
+        Returns (found, payload). found is False on a miss or an expired entry;
+        payload is None for a cached negative result.
+        """
+        item_id = str(item_id)
+        now = time.time()
+        with self._lock:
+            entry = self.entries.get(item_id)
+            if entry is not None:
+                ttl = self.ttl if entry['status'] == 'ok' else self.negative_ttl
+                if now - entry['fetched'] < ttl:
+                    entry['used'] = now
+                    self._dirty = True
+                    if entry['status'] == 'ok':
+                        self.hits += 1
+                        return True, entry['data']
+                    self.negative_hits += 1
+                    return True, None
+                del self.entries[item_id]
+            self.misses += 1
+            return False, None
+
+    def store(self, item_id, payload, status=None):
+        """
+        Stores a payload, or a negative result when payload is None. status
+        defaults to 'ok' or 'missing' and can be set to e.g. 'error'.
+        """
+        now = time.time()
+        with self._lock:
+            self.entries[str(item_id)] = {
+                'status': status or ('ok' if payload is not None else 'missing'),
+                'fetched': now,
+                'used': now,
+                'data': payload,
+            }
+            self._dirty = True
+            self._evict()
+
+    def _evict(self):
+        overflow = len(self.entries) - self.max_entries
+        if overflow <= 0:
+            return
+        for item_id in sorted(self.entries, key=lambda k: self.entries[k]['used'])[:overflow]:
+            del self.entries[item_id]
+        self.evictions += overflow
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [item_id for item_id, entry in self.entries.items()
+                       if now - entry['fetched'] >= (self.ttl if entry['status'] == 'ok' else self.negative_ttl)]
+            for item_id in expired:
+                del self.entries[item_id]
+            if expired:
+                self._dirty = True
+        return len(expired)
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'negative_hits': self.negative_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def save(self):
+        """
+        Drops expired entries, then writes the cache back to disk if it
+        changed, via a temp file and rename.
+        """
+        self.purge_expired()
+        with self._lock:
+            if not self._dirty:
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f, ensure_ascii=False, sort_keys=True)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+
+
+class BlizzardClient:
+    """
+    Item API client sharing one pooled session across threads. The OAuth token
+    is only requested on the first API call and reused until shortly before it
+    expires. Requests are spaced to stay under requests_per_second, and
+    connection errors, 429s and 5xx responses are retried with backoff. When
+    an ItemCache is given, cached payloads and negative results are served
+    without touching the network.
+    """
+
+    def __init__(self, client_id, client_secret, region='us', oauth_url=None, api_url=None,
+                 max_workers=8, requests_per_second=50, max_retries=3, timeout=10, cache=None):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.region = region
+        self.oauth_url = (oauth_url or OAUTH_URL).format(region=region)
+        self.api_url = (api_url or API_URL).format(region=region)
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.cache = cache
+        self.api_calls = 0
+        self.api_errors = 0
+        self.api_latencies = []
+        self._stats_lock = threading.Lock()
+
+        retry = Retry(total=max_retries, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=None, respect_retry_after_header=True, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._token = None
+        self._token_expires = 0.0
+        self._token_lock = threading.Lock()
+
+        self._min_interval = 1.0 / requests_per_second if requests_per_second else 0.0
+        self._next_request = 0.0
+        self._rate_lock = threading.Lock()
+
+    def get_access_token(self):
+        with self._token_lock:
+            if self._token is None or time.monotonic() >= self._token_expires:
+                response = self.session.post(self.oauth_url, data={'grant_type': 'client_credentials'},
+                                             auth=(self.client_id, self.client_secret), timeout=self.timeout)
+                response.raise_for_status()
+                payload = response.json()
+                self._token = payload['access_token']
+                # Refresh a minute early so in-flight requests never carry an expired token
+                self._token_expires = time.monotonic() + max(payload.get('expires_in', 86400) - 60, 0)
+            return self._token
+
+    def _throttle(self):
+        if not self._min_interval:
+            return
+        with self._rate_lock:
+            now = time.monotonic()
+            wait = self._next_request - now
+            self._next_request = max(now, self._next_request) + self._min_interval
+        if wait > 0:
+            time.sleep(wait)
+
+    def get_item_data(self, item_id):
+        """
+        Fetches a single item. Returns the item payload, or None if the item
+        does not exist or the request failed after retries. A failed token
+        request raises, since it would fail for every item alike.
+        """
+        if self.cache is not None:
+            found, payload = self.cache.lookup(item_id)
+            if found:
+                return payload
+        return self._fetch_item(item_id, self.get_access_token())
+
+    def _fetch_item(self, item_id, token):
+        """
+        Requests an item from the API. Only answers about the item itself,
+        a 404 or a 5xx, are cached as negative results; connection errors
+        are not, so the item is retried on the next run. A 401 or 403 means
+        the credentials are wrong and raises.
+        """
+        self._throttle()
+        start = time.perf_counter()
+        try:
+            response = self.session.get(
+                f'{self.api_url}/data/wow/item/{item_id}',
+                headers={'Authorization': f'Bearer {token}'},
+                params={'namespace': f'static-classic1x-{self.region}', 'locale': 'en_US'},
+                timeout=self.timeout,
+            )
+        except requests.RequestException as e:
+            self._record_call(start, error=True)
+            log.warning(f"Error fetching item {item_id}: {e}")
+            return None
+        self._record_call(start, error=response.status_code != 200)
+        if response.status_code in (401, 403):
+            response.raise_for_status()
+        if response.status_code != 200:
+            log.warning(f"Item {item_id} lookup returned HTTP {response.status_code}")
+            if self.cache is not None and (response.status_code == 404 or response.status_code >= 500):
+                self.cache.store(item_id, None, status='missing' if response.status_code == 404 else 'error')
+            return None
+        payload = response.json()
+        if self.cache is not None:
+            self.cache.store(item_id, payload)
+        return payload
+
+    def _record_call(self, start, error=False):
+        with self._stats_lock:
+            self.api_calls += 1
+            if error:
+                self.api_errors += 1
+            self.api_latencies.append(time.perf_counter() - start)
+
+    def api_stats(self):
+        """
+        Returns the API call count, failures and latencies (in seconds,
+        including retries) for this client.
+        """
+        latencies = sorted(self.api_latencies)
+        stats = {'calls': self.api_calls, 'errors': self.api_errors}
+        if latencies:
+            stats.update({
+                'latency_mean': round(sum(latencies) / len(latencies), 4),
+                'latency_p50': round(latencies[len(latencies) // 2], 4),
+                'latency_p95': round(latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)], 4),
+                'latency_max': round(latencies[-1], 4),
+            })
+        return stats
+
+    def prefetch_items(self, item_ids):
+        """
+        Fetches all given items concurrently. Cached items are served from
+        the cache and the token is requested once before the workers start,
+        so bad credentials raise instead of failing every item.
+
+        Args:
+            item_ids: An iterable of item IDs.
+
+        Returns:
+            A dictionary of {item_id: item payload or None}.
+        """
+        results = {}
+        to_fetch = []
+        for item_id in dict.fromkeys(item_ids):
+            found, payload = self.cache.lookup(item_id) if self.cache is not None else (False, None)
+            if found:
+                results[item_id] = payload
+            else:
+                to_fetch.append(item_id)
+        if not to_fetch:
+            return results
+
+        # One token for the whole batch, requested before any worker starts
+        token = self.get_access_token()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results.update(zip(to_fetch, executor.map(lambda item_id: self._fetch_item(item_id, token), to_fetch)))
+        return results
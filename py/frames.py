@@ -0,0 +1,401 @@
+import json
+import logging
+import os
+
+import pandas as pd
+
+from artifacts import load_json, write_json_atomic
+from blizz_item_fetch import BlizzardClient, ItemCache, CLIENT_ID, SECRET
+from identity import IdentityResolver
+from loot_converter import (ISO_DATE, RAIDS, build_item_index, get_item_name_and_raid, lookup_dir,
+                            merge_raid_data)
+from lookup_store import LookupTableStore
+from model import ITEM_LINK
+from phases import PhaseIndex, load_archived_data, load_phases
+from resolution import load_rules, match_rule, queue_boss, queue_item
+from softres_converter import merge_softres_data
+
+base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+analytics_file = os.path.join(base_dir, 'data', 'analytics.json')
+
+log = logging.getLogger(__name__)
+
+LOOT_COLUMNS = ['date_time', 'character', 'item_id', 'offspec', 'unique_id']
+# Columns of the soft reserve export that are not kept in item_info
+SR_DROPPED_COLUMNS = ['Name', 'Note', 'Discord ID', 'Plus']
+
+
+def read_loot_export(path):
+    """
+    Loads a loot export as a DataFrame with LOOT_COLUMNS, applying the same
+    checks as loot_converter.LootExportReader. Malformed lines are logged
+    and skipped.
+
+    Returns:
+        A tuple (frame, malformed) where malformed lists (line number, line).
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = pd.Series(f.read().split('\n')[1:], dtype=object)
+    lines.index = range(2, len(lines) + 2)
+    lines = lines.str.strip()
+    lines = lines[lines != '']
+
+    fields = lines.str.split(',')
+    fields = fields[fields.str.len() == 5]
+    frame = pd.DataFrame(fields.tolist(), columns=LOOT_COLUMNS, index=fields.index, dtype=object)
+    valid = frame['date_time'].str.match(ISO_DATE.pattern) & frame['offspec'].isin(['0', '1'])
+    frame = frame[valid]
+
+    malformed = [(line_no, line) for line_no, line in lines.items() if line_no not in frame.index]
+    for line_no, line in malformed:
+        log.warning(f"Skipping malformed line {line_no} in {os.path.basename(path)}: {line}")
+    return frame.reset_index(drop=True), malformed
+
+
+def read_softres_export(path):
+    """
+    Loads a Gargul soft reserve export as a DataFrame of strings.
+    """
+    try:
+        return pd.read_csv(path, dtype=str, keep_default_na=False)
+    except FileNotFoundError:
+        log.error(f"Error: CSV file not found at {path}")
+    except pd.errors.EmptyDataError:
+        pass
+    return pd.DataFrame(columns=['Item', 'ItemId', 'From', 'Name', 'Date'], dtype=object)
+
+
+def item_frame(item_index):
+    """
+    Returns the lookup tables (see loot_converter.build_item_index) as a
+    DataFrame with item_id, raid and item_name columns.
+    """
+    return pd.DataFrame([(item_id, raid, item_name) for item_id, (raid, item_name) in item_index.items()],
+                        columns=['item_id', 'raid', 'item_name'], dtype=object)
+
+
+def boss_frame(boss_dict):
+    """
+    Returns bosses_per_raid.json as a DataFrame with From (the boss) and
+    raid columns. Like decode_gargul_string, the first instance listing a
+    boss wins.
+    """
+    try:
+        with open(boss_dict, 'r', encoding='utf-8') as f:
+            boss_data = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        boss_data = {}
+    pairs = [(boss, instance) for instance, bosses in boss_data.items() for boss in bosses['boss_names']]
+    return pd.DataFrame(pairs, columns=['From', 'raid'], dtype=object).drop_duplicates('From')
+
+
+def canonical_names(names, resolver, source):
+    """
+    Maps a column of character names to their canonical names and whether
+    they are on the roster. Each distinct name is resolved once; names not
+    on the roster are counted in resolver.unknown per row, like
+    IdentityResolver.resolve.
+
+    Returns:
+        A tuple (canonical, on_roster) of Series aligned with names.
+    """
+    canonical = names.map({name: resolver.canonical(name) for name in names.unique()})
+    on_roster = canonical.isin(resolver.roster)
+    for name, count in canonical[~on_roster].value_counts(sort=False).items():
+        counts = resolver.unknown.setdefault(name, {})
+        counts[source] = counts.get(source, 0) + int(count)
+    return canonical, on_roster
+
+
+def convert_loot_export(roster_file, exported_data, client=None, pending=None, resolver=None, stats=None,
+                        item_index=None, rules=None, lookup_store=None):
+    """
+    DataFrame version of loot_converter.convert_txt_to_JSON in batch mode.
+    The roster filter and the raid lookup are merges against the roster
+    and the lookup tables; only items missing from the lookup tables go
+    through get_item_name_and_raid, once per item. Rows that cannot be
+    assigned to a raid are queued in pending. The result is the same raid
+    data, in the same order, as convert_txt_to_JSON produces.
+    """
+    if pending is None:
+        raise ValueError("A pending-resolution queue is required, the DataFrame path never prompts")
+    if client is None:
+        client = BlizzardClient(CLIENT_ID, SECRET, cache=ItemCache())
+    if item_index is None:
+        item_index, _ = build_item_index(lookup_dir)
+    if rules is None:
+        rules = load_rules()
+    owns_lookup_store = lookup_store is None
+    if owns_lookup_store:
+        lookup_store = LookupTableStore(lookup_dir)
+    owns_resolver = resolver is None
+    if owns_resolver:
+        resolver = IdentityResolver(roster_file)
+    log.info(f"Roster: {len(resolver.roster)} characters, {len(resolver.aliases)} aliases")
+
+    loot, malformed = read_loot_export(exported_data)
+    rows = len(loot)
+    max_date_str = loot['date_time'].max() if rows else None
+    log.info(f"Read {rows} loot rows for raid week {max_date_str}, skipped {len(malformed)} malformed lines")
+
+    loot['character'], on_roster = canonical_names(loot['character'], resolver, 'loot')
+    unknown_characters = int((~on_roster).sum())
+    loot = loot[on_roster]
+    # Rows of unknown items are applied after the known ones, as in convert_txt_to_JSON
+    loot = loot.assign(deferred=~loot['item_id'].isin(item_index.keys()))
+    loot = loot.merge(item_frame(item_index), on='item_id', how='left', sort=False)
+    loot['spec'] = loot['offspec'].map({'1': "Offspec", '0': "Mainspec"})
+    deferred_rows = int(loot['deferred'].sum())
+
+    # Fetch every unknown item in one batch, then resolve each item once
+    unknown_items = sorted(loot.loc[loot['deferred'], 'item_id'].unique())
+    prefetched = client.prefetch_items(unknown_items)
+    if prefetched:
+        log.info(f"Prefetched {len(prefetched)} unknown items from the API")
+    try:
+        resolved = {item_id: get_item_name_and_raid(item_index, item_id, client, RAIDS, prefetched, rules,
+                                                    interactive=False, lookup_store=lookup_store)
+                    for item_id in unknown_items}
+    finally:
+        if owns_lookup_store:
+            lookup_store.flush()
+    if resolved:
+        deferred = loot['deferred']
+        loot.loc[deferred, 'raid'] = loot.loc[deferred, 'item_id'].map({k: v[0] for k, v in resolved.items()})
+        loot.loc[deferred, 'item_name'] = loot.loc[deferred, 'item_id'].map({k: v[1] for k, v in resolved.items()})
+    loot = loot.sort_values('deferred', kind='stable')
+
+    unresolved = loot['deferred'] & loot['raid'].isna()
+    for row in loot[unresolved].itertuples(index=False):
+        queue_item(pending, row.item_id, None if row.item_name == row.item_id else row.item_name, {
+            "dateTime": row.date_time, "character": row.character, "spec": row.spec,
+            "id": row.unique_id, "raidWeek": max_date_str,
+        })
+    loot = loot[~unresolved & (loot['raid'] != "Trash") & (loot['character'] != "_disenchanted")]
+
+    events = loot.groupby(['character', 'spec', 'item_id', 'unique_id'], sort=False).agg(
+        dateTime=('date_time', list), item_name=('item_name', 'first'), raid=('raid', 'first'))
+    raid_data = {}
+    for (character, spec, item_id, unique_id), date_times, item_name, raid in events.itertuples(name=None):
+        items = raid_data.setdefault(character, {"Mainspec": {}, "Offspec": {}})[spec]
+        if item_id not in items:
+            items[item_id] = {
+                "itemName": item_name if item_name else item_id,
+                "itemLink": ITEM_LINK.format(item_id),
+                "raid": raid,
+                "lootEvents": [],
+            }
+        items[item_id]["lootEvents"].append({"dateTime": date_times, "timesLooted": len(date_times), "id": unique_id,
+                                             "raidWeek": [max_date_str] * len(date_times)})
+
+    if client.cache is not None:
+        client.cache.save()
+        log.info(f"Item cache: {client.cache.stats()}")
+
+    if stats is not None:
+        stats.update({
+            'rows': rows,
+            'malformed_rows': len(malformed),
+            'unknown_character_rows': unknown_characters,
+            'lookup_table': {'hits': rows - unknown_characters - deferred_rows, 'misses': deferred_rows,
+                             'unknown_items': len(unknown_items)},
+            'item_cache': client.cache.stats() if client.cache is not None else None,
+            'api': client.api_stats(),
+        })
+
+    if owns_resolver:
+        resolver.report()
+    return raid_data
+
+
+def decode_softres_export(softres_export, boss_dict, pending=None, resolver=None, stats=None):
+    """
+    DataFrame version of softres_converter.decode_gargul_string in batch
+    mode, without an existing file to decode on top of (merge the result
+    with merge_softres_data instead). Bosses are matched to raids with a
+    merge against bosses_per_raid.json; the resolution rules are applied
+    once per unmatched boss and item, and rows that still have no raid are
+    queued in pending. A malformed Date raises ValueError.
+    """
+    if pending is None:
+        raise ValueError("A pending-resolution queue is required, the DataFrame path never prompts")
+    rules = load_rules()
+    if resolver is None:
+        resolver = IdentityResolver()
+
+    sr = read_softres_export(softres_export)
+    missing = [column for column in ('Name', 'Item', 'From', 'Date') if column not in sr.columns]
+    if missing:
+        raise ValueError(f"{softres_export} is missing the columns {', '.join(missing)}")
+    # Validated before anything is queued, like decode_gargul_string
+    dates = pd.to_datetime(sr['Date'], format="%Y-%m-%d %H:%M:%S", errors='coerce')
+    if dates.isna().any():
+        line_no = int(dates.isna().to_numpy().argmax())
+        raise ValueError(f"Malformed Date on line {line_no + 2} of {softres_export}: {sr['Date'].iloc[line_no]!r}")
+    rows = len(sr)
+    max_date_str = dates.max().strftime("%Y-%m-%d") if rows else None
+
+    sr['Name'], _ = canonical_names(sr['Name'], resolver, 'softres')
+    info_columns = [column for column in sr.columns if column not in SR_DROPPED_COLUMNS]
+    sr = sr.merge(boss_frame(boss_dict), on='From', how='left', sort=False)
+
+    unmatched = sr.loc[sr['raid'].isna(), ['From', 'Item']].drop_duplicates()
+    by_rule = {(boss, item): match_rule(rules, 'bosses', boss) or match_rule(rules, 'items', item)
+               for boss, item in unmatched.itertuples(index=False)}
+    if by_rule:
+        missing = sr['raid'].isna()
+        sr.loc[missing, 'raid'] = [by_rule[key] for key in zip(sr.loc[missing, 'From'], sr.loc[missing, 'Item'])]
+
+    queued = sr['raid'].isna()
+    for row in sr[queued].to_dict('records'):
+        log.warning(f"Boss '{row['From']}' not found in any raid instance, queued '{row['Item']}' for resolution.")
+        queue_boss(pending, row['From'], row['Item'], {'name': row['Name'],
+                                                       'row': {column: row[column] for column in info_columns},
+                                                       'raidWeek': max_date_str})
+    sr = sr[~queued]
+
+    grouped = sr.groupby(['raid', 'From', 'Name', 'Item'], sort=False)
+    first_rows = grouped[info_columns].first()
+    dates = grouped['Date'].agg(lambda values: list(dict.fromkeys(values)))
+    counts = grouped.size()
+
+    data = {}
+    for key, row in zip(first_rows.index, first_rows.to_dict('records')):
+        raid_instance, boss, name, item = key
+        item_info = {**row, 'Date': dates[key], 'Number reserved': int(counts[key])}
+        data.setdefault(raid_instance, {}).setdefault(boss, {}).setdefault(name, {})[item] = {
+            'item_info': item_info,
+            'raid_dates': [max_date_str] * int(counts[key]) if max_date_str else [],
+        }
+
+    if stats is not None:
+        stats.update({'rows': rows, 'queued_rows': int(queued.sum())})
+    return data
+
+
+def loot_frame(raid_data):
+    """
+    Flattens raid_data to one row per loot event.
+    """
+    records = [(character, spec, item_id, item_data['itemName'], item_data['raid'], event['id'],
+                event['dateTime'][0], event['raidWeek'], event['timesLooted'], bool(event.get('wasSr')))
+               for character, specs in raid_data.items() for spec, items in specs.items()
+               for item_id, item_data in items.items() for event in item_data['lootEvents']]
+    return pd.DataFrame(records, columns=['character', 'spec', 'item_id', 'item_name', 'raid', 'event_id',
+                                          'date', 'raid_weeks', 'times_looted', 'was_sr'])
+
+
+def softres_frame(softres_data):
+    """
+    Flattens softres_data to one row per reservation and raid week.
+    """
+    records = [(raid_instance, boss, character, item, entry['item_info']['ItemId'], week)
+               for raid_instance, bosses in softres_data.items() for boss, characters in bosses.items()
+               for character, items in characters.items() for item, entry in items.items()
+               for week in entry['raid_dates']]
+    return pd.DataFrame(records, columns=['raid', 'boss', 'character', 'item', 'item_id', 'raid_week'])
+
+
+def update_was_sr(raid_data, softres_data, characters=None):
+    """
+    DataFrame version of softres_converter.update_was_sr: loot events are
+    matched to soft reserves with one merge on (character, item_id, raid
+    week) instead of a lookup per event. Events already flagged are left
+    untouched.
+    """
+    events = []
+    keys = []
+    for character, specs in raid_data.items():
+        if characters is not None and character not in characters:
+            continue
+        for items in specs.values():
+            for item_id, item_data in items.items():
+                for event in item_data['lootEvents']:
+                    if event.get('wasSr'):
+                        continue
+                    events.append(event)
+                    keys.extend((len(events) - 1, character, item_id, week) for week in event['raidWeek'])
+
+    weeks = pd.DataFrame(keys, columns=['event', 'character', 'item_id', 'raid_week'])
+    reserved = softres_frame(softres_data)[['character', 'item_id', 'raid_week']].drop_duplicates()
+    matched = set(weeks.merge(reserved, on=['character', 'item_id', 'raid_week'])['event'])
+
+    for position, event in enumerate(events):
+        event['wasSr'] = position in matched
+    log.info(f"wasSr: checked {len(events)} loot events, {len(matched)} newly matched to a soft reserve")
+    return raid_data
+
+
+def unfulfilled_srs(raid_data, softres_data):
+    """
+    Compares every soft reserve with the loot of its raid week. A
+    reservation is fulfilled when the character received the item in that
+    week.
+
+    Returns:
+        A DataFrame with one row per (raid_week, character, item_id) and a
+        fulfilled column.
+    """
+    reserved = softres_frame(softres_data)[['raid_week', 'character', 'item_id', 'item']].drop_duplicates(
+        ['raid_week', 'character', 'item_id'])
+    looted = loot_frame(raid_data).explode('raid_weeks').rename(columns={'raid_weeks': 'raid_week'})
+    looted = looted[['raid_week', 'character', 'item_id']].drop_duplicates()
+    looted['fulfilled'] = True
+    merged = reserved.merge(looted, on=['raid_week', 'character', 'item_id'], how='left')
+    merged['fulfilled'] = merged['fulfilled'].eq(True)
+    return merged
+
+
+def _sr_totals(frame, by):
+    totals = frame.groupby(by)['fulfilled'].agg(reserved='size', fulfilled='sum')
+    totals['unfulfilled'] = totals['reserved'] - totals['fulfilled']
+    return {key: {column: int(value) for column, value in row.items()}
+            for key, row in totals.sort_index().to_dict('index').items()}
+
+
+def loot_per_phase(raid_data, phases=None):
+    """
+    Counts the loot of every character per phase and spec, by the first
+    date of each loot event.
+
+    Returns:
+        {phase id: {character: {"Mainspec": n, "Offspec": n}}}
+    """
+    index = PhaseIndex(phases or load_phases())
+    loot = loot_frame(raid_data)
+    loot['phase'] = loot['date'].map(index.phase_of)
+    counts = loot.pivot_table(index=['phase', 'character'], columns='spec', values='times_looted', aggfunc='sum',
+                              fill_value=0)
+    result = {}
+    for (phase_id, character), row in counts.sort_index().iterrows():
+        result.setdefault(phase_id, {})[character] = {spec: int(row.get(spec, 0)) for spec in ("Mainspec", "Offspec")}
+    return result
+
+
+def build_analytics(raid_data, softres_data, phases=None):
+    """
+    Fairness analytics over the loot and soft reserve history:
+    soft reserves fulfilled and unfulfilled per raid week and per
+    character, and loot per character per phase.
+    """
+    srs = unfulfilled_srs(raid_data, softres_data)
+    return {
+        'unfulfilledSrPerWeek': _sr_totals(srs, 'raid_week'),
+        'unfulfilledSrPerCharacter': _sr_totals(srs, 'character'),
+        'lootPerCharacterPerPhase': loot_per_phase(raid_data, phases),
+    }
+
+
+def write_analytics(out_dir, path=analytics_file):
+    """
+    Builds the analytics over the active phase and the archived phases
+    and writes them to path.
+    """
+    raid_data, softres_data = load_archived_data(out_dir)
+    merge_raid_data(raid_data, load_json(os.path.join(out_dir, 'raid_data.json')) or {})
+    merge_softres_data(softres_data, load_json(os.path.join(out_dir, 'softres_data.json')) or {})
+    analytics = build_analytics(raid_data, softres_data)
+    write_json_atomic(path, analytics, indent=2)
+    weeks = analytics['unfulfilledSrPerWeek']
+    log.info(f"Wrote analytics for {len(weeks)} raid weeks and {len(raid_data)} characters to {os.path.basename(path)}")
+    return analytics
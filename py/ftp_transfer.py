@@ -1,8 +1,212 @@
 import ftplib
-from dotenv import load_dotenv
+import glob
+import hashlib
+import json
+import logging
 import os
+import time
+
+base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+deploy_manifest_file = os.path.join(base_dir, 'data', 'deploy_manifest.json')
+
+log = logging.getLogger(__name__)
+
+# Everything the site serves, relative to the repository root
+DEPLOY_PATTERNS = [
+    'index.html',
+    'script.js',
+    'style.css',
+    'img/*',
+    'data/raid_data*.json*',
+    'data/softres_data*.json*',
+    'data/summary*.json*',
+    'data/shards/*',
+    'data/archive/manifest.json*',
+    'data/archive/*/*',
+]
+
+
+def content_hash(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def collect_artifacts(root=base_dir, patterns=DEPLOY_PATTERNS):
+    """
+    Returns {relative path: sha256} for every deployable file under root.
+    """
+    artifacts = {}
+    for pattern in patterns:
+        for path in sorted(glob.glob(os.path.join(root, pattern))):
+            if os.path.isfile(path):
+                artifacts[os.path.relpath(path, root).replace(os.sep, '/')] = content_hash(path)
+    return artifacts
+
+
+def load_deploy_manifest(path=deploy_manifest_file):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_deploy_manifest(manifest, path=deploy_manifest_file):
+    with open(path, 'w', encoding='utf-8') as outfile:
+        json.dump(manifest, outfile, indent=2, sort_keys=True)
+        outfile.write('\n')
+
+
+class FtpPublisher:
+    """
+    Uploads files over a single FTP connection that is reused for every file
+    and reopened when it drops. Each file is written to a temporary name and
+    renamed into place once complete, and an interrupted upload is resumed
+    with REST on the next attempt.
+    """
+
+    def __init__(self, host, user, password, remote_dir='loothistory', port=21, max_retries=3, timeout=30):
+        self.host = host
+        self.user = user
+        self.password = password
+        self.remote_dir = remote_dir.strip('/')
+        self.port = port
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.ftp = None
+        self.known_dirs = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def connect(self):
+        if self.ftp is None:
+            self.ftp = ftplib.FTP()
+            self.ftp.connect(self.host, self.port, timeout=self.timeout)
+            self.ftp.login(user=self.user, passwd=self.password)
+            self.ftp.voidcmd('TYPE I')  # SIZE and REST need binary mode
+            self.known_dirs = set()
+        return self.ftp
+
+    def close(self):
+        if self.ftp is not None:
+            try:
+                self.ftp.quit()
+            except ftplib.all_errors:
+                self.ftp.close()
+            self.ftp = None
+
+    def _ensure_dir(self, remote_dir):
+        path = ''
+        for part in remote_dir.split('/'):
+            path = f"{path}/{part}" if path else part
+            if path in self.known_dirs:
+                continue
+            try:
+                self.ftp.mkd(path)
+            except ftplib.error_perm:
+                pass  # Already exists
+            self.known_dirs.add(path)
+
+    def _remote_size(self, remote_path):
+        try:
+            return self.ftp.size(remote_path) or 0
+        except ftplib.error_perm:
+            return 0
+
+    def upload(self, local_path, remote_name, digest=None):
+        """
+        Uploads local_path to remote_name (relative to remote_dir).
+
+        Args:
+            local_path: The file to upload.
+            remote_name: The target path on the server, using '/' separators.
+            digest: The file's sha256, used to name the temporary file so a
+                    resumed upload never appends to a different version.
+        """
+        remote_path = f"{self.remote_dir}/{remote_name}" if self.remote_dir else remote_name
+        remote_dir, filename = os.path.split(remote_path)
+        digest = digest or content_hash(local_path)
+        tmp_path = f"{remote_dir}/.{filename}.{digest[:12]}.part" if remote_dir else f".{filename}.{digest[:12]}.part"
+        local_size = os.path.getsize(local_path)
+
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                self.connect()
+                if remote_dir:
+                    self._ensure_dir(remote_dir)
+                # A .part left by an earlier attempt or run has the same digest, so it can be resumed
+                offset = self._remote_size(tmp_path)
+                if offset > local_size:
+                    offset = 0
+                if offset < local_size or local_size == 0:
+                    with open(local_path, 'rb') as f:
+                        f.seek(offset)
+                        self.ftp.storbinary(f"STOR {tmp_path}", f, rest=offset or None)
+                try:
+                    self.ftp.rename(tmp_path, remote_path)
+                except ftplib.error_perm:
+                    # Some servers refuse to rename over an existing file
+                    self.ftp.delete(remote_path)
+                    self.ftp.rename(tmp_path, remote_path)
+                return
+            except ftplib.all_errors as e:
+                log.warning(f"FTP error uploading {remote_name} (attempt {attempt}/{self.max_retries}): {e}")
+                self.close()
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(attempt)
+
+
+def publish_site(host, user, password, remote_dir='loothistory', port=21, root=base_dir,
+                 manifest_path=deploy_manifest_file, force=False, dry_run=False):
+    """
+    Uploads the site files that changed since the last publish. The hashes
+    of the deployed files are kept in data/deploy_manifest.json, which is
+    updated after every successful upload so an interrupted publish only
+    repeats the files that did not make it.
+
+    Args:
+        host, user, password: The FTP account.
+        remote_dir: The site directory on the server.
+        port: The FTP port.
+        root: The local directory the DEPLOY_PATTERNS are relative to.
+        manifest_path: Where the deployed hashes are stored.
+        force: Upload every file regardless of the manifest.
+        dry_run: Only list the files that would be uploaded.
+
+    Returns:
+        The list of uploaded (or, with dry_run, changed) files.
+    """
+    deployed = {} if force else load_deploy_manifest(manifest_path)
+    artifacts = collect_artifacts(root)
+    changed = [name for name, digest in artifacts.items() if deployed.get(name) != digest]
+    log.info(f"{len(changed)} of {len(artifacts)} site files changed since the last publish")
+    if dry_run or not changed:
+        return changed
+
+    # Upload the data before the pages, and the shard manifest last, so the
+    # page never points at shards that are not on the server yet
+    changed.sort(key=lambda name: ('manifest.json' in name, not name.startswith('data/'), name))
+
+    uploaded = []
+    with FtpPublisher(host, user, password, remote_dir, port) as publisher:
+        try:
+            for name in changed:
+                publisher.upload(os.path.join(root, name), name, artifacts[name])
+                deployed[name] = artifacts[name]
+                uploaded.append(name)
+        finally:
+            save_deploy_manifest(deployed, manifest_path)
+    log.info(f"Uploaded {len(uploaded)} files to {host}")
+    return uploaded
 
-load_dotenv()
 
 def upload_file_to_ftp(filename, ftp_host, ftp_user, ftp_pass):
     """Uploads a file to an FTP server.
@@ -14,19 +218,9 @@ def upload_file_to_ftp(filename, ftp_host, ftp_user, ftp_pass):
         ftp_pass: The password for the FTP account.
     """
     try:
-        # Connect to the FTP server
-        with ftplib.FTP(ftp_host) as ftp:
-            ftp.login(user=ftp_user, passwd=ftp_pass)
-
-            # Open the file in binary mode
-            with open(filename, 'rb') as file:
-                # Upload the file
-                ftp.storbinary(f'STOR loothistory/{filename}', file)
-
-            print(f"File '{filename}' uploaded successfully to {ftp_host}")
+        with FtpPublisher(ftp_host, ftp_user, ftp_pass) as publisher:
+            publisher.upload(filename, os.path.basename(filename))
+        log.info(f"File '{filename}' uploaded successfully to {ftp_host}")
 
     except ftplib.all_errors as e:
-        print(f"FTP error: {e}")
-
-
-upload_file_to_ftp(filename, ftp_host, ftp_user, ftp_pass)
\ No newline at end of file
+        log.error(f"FTP error: {e}")
@@ -0,0 +1,99 @@
+import difflib
+import json
+import logging
+import os
+import unicodedata
+from functools import lru_cache
+
+base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+roster_file = os.path.join(base_dir, 'data', 'roster.txt')
+aliases_file = os.path.join(base_dir, 'data', 'lookup_tables', 'character_aliases.json')
+
+log = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def normalize_name(name):
+    """
+    Normalises a character name as written by the addons: NFC so that
+    decomposed accents ("Bigbèlly") compare equal to composed ones,
+    without non-printable characters and surrounding whitespace.
+    """
+    name = unicodedata.normalize('NFC', name)
+    return ''.join(c for c in name if c.isprintable()).strip()
+
+
+def load_roster(path=roster_file):
+    with open(path, 'r', encoding='utf-8') as f:
+        return {normalize_name(line.replace(",", "")) for line in f if line.strip()}
+
+
+def load_aliases(path=aliases_file):
+    """
+    Loads the alt -> main character aliases, {"Alt": "Main"}.
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            try:
+                aliases = json.load(f)
+            except json.JSONDecodeError:
+                log.warning(f"Error decoding {os.path.basename(path)}. Using no aliases.")
+                aliases = {}
+    except FileNotFoundError:
+        aliases = {}
+    return {normalize_name(alias): normalize_name(main) for alias, main in aliases.items()}
+
+
+class IdentityResolver:
+    """
+    Maps the character names found in the loot and soft reserve exports to
+    roster names, so both datasets use the same name for a character.
+    Names are normalised, then aliases are applied; results are memoised.
+    Names that are not on the roster are collected for report().
+    """
+
+    def __init__(self, roster_path=roster_file, aliases_path=aliases_file):
+        self.roster = load_roster(roster_path)
+        self.aliases = load_aliases(aliases_path)
+        self._canonical = {}
+        self.unknown = {}
+
+    def canonical(self, name):
+        """
+        Returns the normalised, de-aliased form of name, whether or not it
+        is on the roster.
+        """
+        canonical = self._canonical.get(name)
+        if canonical is None:
+            normalized = normalize_name(name)
+            canonical = self._canonical[name] = self.aliases.get(normalized, normalized)
+        return canonical
+
+    def resolve(self, name, source='loot'):
+        """
+        Returns the roster name for name, or None if it is not on the roster.
+        Unknown names are counted per source ('loot' or 'softres').
+        """
+        canonical = self.canonical(name)
+        if canonical in self.roster:
+            return canonical
+        counts = self.unknown.setdefault(canonical, {})
+        counts[source] = counts.get(source, 0) + 1
+        return None
+
+    def suggestions(self, name, n=3):
+        return difflib.get_close_matches(name, self.roster, n=n, cutoff=0.6)
+
+    def report(self):
+        """
+        Logs the names that are not on the roster with the closest roster
+        names, so they can be added to the roster or the aliases file.
+        """
+        if not self.unknown:
+            return
+        log.warning(f"{len(self.unknown)} names not on the roster:")
+        for name, counts in sorted(self.unknown.items()):
+            sources = ', '.join(f"{count} {source} rows" for source, count in sorted(counts.items()))
+            suggestions = self.suggestions(name)
+            hint = f", did you mean {' / '.join(suggestions)}?" if suggestions else ""
+            log.warning(f"- {name} ({sources}){hint}")
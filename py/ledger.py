@@ -0,0 +1,56 @@
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime
+
+base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+ledger_file = os.path.join(base_dir, 'data', 'import_ledger.json')
+
+log = logging.getLogger(__name__)
+
+
+def file_hash(path):
+    """
+    Returns the SHA-256 of a file's contents, or None if it does not exist.
+    """
+    digest = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 16), b''):
+                digest.update(chunk)
+    except FileNotFoundError:
+        return None
+    return digest.hexdigest()
+
+
+def load_ledger(path=ledger_file):
+    """
+    Loads the ledger of already ingested import files, keyed by content hash.
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            try:
+                return json.load(f)
+            except json.JSONDecodeError:
+                log.warning(f"Error decoding {os.path.basename(path)}. Starting with an empty ledger.")
+                return {}
+    except FileNotFoundError:
+        return {}
+
+
+def is_ingested(ledger, content_hash):
+    return content_hash is not None and content_hash in ledger
+
+
+def record_import(ledger, content_hash, kind, path):
+    ledger[content_hash] = {
+        'kind': kind,
+        'file': os.path.basename(path),
+        'ingested': datetime.now().isoformat(timespec='seconds'),
+    }
+
+
+def save_ledger(ledger, path=ledger_file):
+    with open(path, 'w', encoding='utf-8') as outfile:
+        json.dump(ledger, outfile, indent=4, ensure_ascii=False)
@@ -0,0 +1,78 @@
+import json
+import logging
+import os
+
+from artifacts import write_atomic
+
+base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+lookup_dir = os.path.join(base_dir, 'data', 'lookup_tables')
+
+log = logging.getLogger(__name__)
+
+
+def table_path(raid, directory=lookup_dir):
+    """
+    Returns the lookup table of raid, the trash cache for "Trash".
+    """
+    if raid == "Trash":
+        return os.path.join(directory, "trash_item_cache.json")
+    return os.path.join(directory, f"{raid}_loot_table.json")
+
+
+def _item_order(item_id):
+    return (0, int(item_id), '') if item_id.isdigit() else (1, 0, item_id)
+
+
+class LookupTableStore:
+    """
+    Buffers newly resolved items and writes them to the raid loot tables
+    in one go. Each changed table is read and rewritten once per flush()
+    instead of once per item, and written atomically, so an interrupted
+    run never leaves a truncated table. Existing entries keep their order
+    and new ones are appended sorted by item ID, so the same items always
+    give the same file.
+
+    checkpoint flushes automatically once that many items are buffered,
+    so a long interactive run does not lose the raids entered so far.
+    """
+
+    def __init__(self, directory=lookup_dir, checkpoint=50):
+        self.directory = directory
+        self.checkpoint = checkpoint
+        self.pending = {}
+
+    def __len__(self):
+        return sum(len(items) for items in self.pending.values())
+
+    def add(self, item_id, item_name, raid):
+        self.pending.setdefault(raid, {})[item_id] = item_name
+        if self.checkpoint and len(self) >= self.checkpoint:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered items to their tables.
+
+        Returns:
+            The list of tables that were written.
+        """
+        written = []
+        for raid, items in sorted(self.pending.items(), key=lambda kv: str(kv[0])):
+            path = table_path(raid, self.directory)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    table = json.load(f)
+            except FileNotFoundError:
+                table = {}
+            changed = 0
+            for item_id in sorted(items, key=_item_order):
+                if table.get(item_id) != items[item_id]:
+                    table[item_id] = items[item_id]
+                    changed += 1
+            if changed:
+                content = json.dumps(table, indent=2, ensure_ascii=False) + '\n'
+                write_atomic(path, content.encode('utf-8'))
+                written.append(path)
+                log.info(f"Wrote {changed} new items to {os.path.basename(path)}")
+        self.pending = {}
+        return written
@@ -1,134 +1,245 @@
+import glob
 import json
-import unicodedata
-from blizz_item_fetch import get_item_data, get_access_token
-from dotenv import load_dotenv
+import logging
+import re
+from collections import namedtuple
+from blizz_item_fetch import BlizzardClient, ItemCache, CLIENT_ID, SECRET
+from identity import IdentityResolver
+from lookup_store import LookupTableStore
+from model import ITEM_LINK
+from resolution import load_rules, match_rule, queue_item
 import os
-from datetime import datetime
-
-load_dotenv()
-
-CLIENT_ID = os.getenv("CLIENT_ID")
-SECRET = os.getenv("SECRET")
-
-replacements = {
-    "Harkclickone": "Harkshock",
-    "Harkclicktwo": "Harkshock",
-    "Sumsushi": "Minto",
-    "Jwhistler": "Jwhistle",
-}
 
 base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 roster_file = os.path.join(base_dir, 'data', 'roster.txt')
+lookup_dir = os.path.join(base_dir, 'data', 'lookup_tables')
 
-def convert_txt_to_JSON(roster_file, exported_data, existing_raid_data=None):
-    raid_data = existing_raid_data if existing_raid_data else {}
+log = logging.getLogger(__name__)
 
-    with open(exported_data, 'r', encoding='utf-8') as f:
-        file_contents = f.read()
+ISO_DATE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
 
-    file_contents = file_contents.encode("utf-8").decode("utf-8")
-    lines = file_contents.splitlines()
-    lines_iterator = iter(lines)
-    next(lines_iterator)
-    num_items = 1
-    access_token = get_access_token(CLIENT_ID, SECRET)
+# The raids an item can be assigned to, besides "Trash"
+RAIDS = ['AQ', 'BWL', 'MC', 'Naxx', "Other", "WB"]
 
-    raids = ['AQ', 'BWL', 'MC', 'Naxx', "Other", "WB"]
-    item_cache = {}
+LootRow = namedtuple('LootRow', ['date_time', 'character', 'item_id', 'offspec', 'unique_id'])
 
-    for raid in raids:
-        loot_table_path = os.path.join(base_dir, 'data', 'lookup_tables', f'{raid}_loot_table.json')
-        try:
-            with open(loot_table_path, 'r', encoding='utf-8') as f:
-                try:
-                    item_cache[raid] = json.load(f)
-                except json.JSONDecodeError:
-                    print(f"Error decoding {raid}_loot_table.json. Assuming empty.")
-                    item_cache[raid] = {}  # Treat as empty if decoding fails
-        except FileNotFoundError:
-            item_cache[raid] = {}
-
-    trash_item_cache_path = os.path.join(base_dir, 'data', 'lookup_tables', 'trash_item_cache.json')
+
+def _load_lookup_table(path):
     try:
-        with open(trash_item_cache_path, 'r', encoding='utf-8') as f:
+        with open(path, 'r', encoding='utf-8') as f:
             try:
-                trash_items = json.load(f)
+                return json.load(f)
             except json.JSONDecodeError:
-                print("Error decoding trash_item_cache.json. Assuming empty.")
-                trash_items = {}
+                log.warning(f"Error decoding {os.path.basename(path)}. Assuming empty.")
+                return {}
     except FileNotFoundError:
-        trash_items = {}
+        return {}
 
-    with open(roster_file, 'r', encoding='utf-8') as f:
-        roster = [line.strip().replace(",", "") for line in f]
-        print(roster)
 
-    # Calculate the max date in the current import
-    max_date = None
-    for line in lines[1:]:
-        date_time, _, _, _, _ = line.strip().split(',')
-        current_date = datetime.strptime(date_time, "%Y-%m-%d")
-        if max_date is None or current_date > max_date:
-            max_date = current_date
+def build_item_index(lookup_dir):
+    """
+    Builds a reverse index of item_id -> (raid, item name) from every
+    *_loot_table.json in lookup_dir plus trash_item_cache.json. Trash items
+    are indexed under the raid "Trash". The precedence is that of the
+    original per-row lookup: raid tables are applied in sorted order, so
+    when an ID appears in more than one table the later one wins, and the
+    trash cache wins over every raid table except the last one (WB). Every
+    clash is reported.
+
+    Args:
+        lookup_dir: The directory containing the lookup tables.
+
+    Returns:
+        A tuple (item_index, conflicts) where conflicts is a list of
+        (item_id, kept_raid, dropped_raid) tuples.
+    """
+    item_index = {}
+    conflicts = []
 
-    max_date_str = max_date.strftime("%Y-%m-%d") if max_date else None
+    last_raid = None
+    for loot_table_path in sorted(glob.glob(os.path.join(lookup_dir, '*_loot_table.json'))):
+        raid = last_raid = os.path.basename(loot_table_path)[:-len('_loot_table.json')]
+        for item_id, item_name in _load_lookup_table(loot_table_path).items():
+            if item_id in item_index and item_index[item_id][0] != raid:
+                conflicts.append((item_id, raid, item_index[item_id][0]))
+            item_index[item_id] = (raid, item_name)
 
-    for line in lines[1:]:
-        num_items += 1
-        date_time, character, item_id, offspec, unique_id = line.strip().split(',')
+    trash_items = _load_lookup_table(os.path.join(lookup_dir, 'trash_item_cache.json'))
+    for item_id, item_name in trash_items.items():
+        if item_id in item_index:
+            if item_index[item_id][0] == last_raid:
+                conflicts.append((item_id, last_raid, "Trash"))
+                continue
+            conflicts.append((item_id, "Trash", item_index[item_id][0]))
+        item_index[item_id] = ("Trash", item_name)
 
-        character = unicodedata.normalize('NFC', character)
-        character = ''.join(c for c in character if c.isprintable())
-        character = replacements.get(character, character)
+    for item_id, kept_raid, dropped_raid in conflicts:
+        log.warning(f"Lookup conflict: item {item_id} is listed in both {kept_raid} and {dropped_raid}, using {kept_raid}")
 
-        if character not in roster:
-            print(character)
-            continue
+    return item_index, conflicts
 
-        spec = "Offspec" if offspec == "1" else "Mainspec"
 
-        # Determine the raid and fetch item name
-        current_raid, item_name = get_item_name_and_raid(trash_items, item_id, item_cache, access_token, raids)
-        print("Item:", item_name, "Current Raid:", current_raid)
+class LootExportReader:
+    """
+    Streams a loot export line by line and yields LootRow tuples. Malformed
+    lines are reported and skipped instead of aborting the import. While
+    iterating, max_date tracks the latest date seen, which is the raid week
+    of the import once the reader is exhausted.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.max_date = None
+        self.rows = 0
+        self.malformed = []
+
+    def __iter__(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            next(f, None)  # Skip the header
+            for line_no, line in enumerate(f, start=2):
+                line = line.strip()
+                if not line:
+                    continue
+                fields = line.split(',')
+                if len(fields) != 5 or not ISO_DATE.match(fields[0]) or fields[3] not in ('0', '1'):
+                    log.warning(f"Skipping malformed line {line_no} in {os.path.basename(self.path)}: {line}")
+                    self.malformed.append((line_no, line))
+                    continue
+
+                date_time, character, item_id, offspec, unique_id = fields
+                # ISO dates compare correctly as strings
+                if self.max_date is None or date_time > self.max_date:
+                    self.max_date = date_time
+                self.rows += 1
+                yield LootRow(date_time, character, item_id, offspec == '1', unique_id)
+
+
+def convert_txt_to_JSON(roster_file, exported_data, existing_raid_data=None, client=None, interactive=True, pending=None,
+                        resolver=None, stats=None, item_index=None, rules=None, lookup_store=None):
+    """
+    Converts a loot export into the raid data structure. In batch mode
+    (interactive=False) rows whose item cannot be assigned to a raid are
+    queued in pending instead of prompting, and ingestion carries on.
+
+    Character names are mapped to roster names by resolver (see
+    identity.IdentityResolver); rows for characters not on the roster are
+    skipped. Pass the same resolver to decode_gargul_string so both
+    datasets agree on names. Without one, a resolver is built from
+    roster_file and its unknown-names report is printed here.
+
+    The export is read in a single streaming pass. Rows for items missing
+    from the lookup tables are held back until the end of the pass, fetched
+    from the API in one batch and then applied. Since the raid week is only
+    known once the whole file has been read, events get a placeholder raid
+    week that is filled in afterwards.
+
+    If a stats dictionary is given it is filled with row counts, lookup
+    table hits and misses, item cache statistics and API call statistics.
+    item_index (see build_item_index) and rules can be passed in to reuse
+    them across imports; newly resolved items are added to item_index and
+    buffered in lookup_store (see lookup_store.LookupTableStore). Without a
+    store the loot tables are written once at the end of the conversion.
+    """
+    raid_data = existing_raid_data if existing_raid_data else {}
+    if not interactive and pending is None:
+        raise ValueError("A pending-resolution queue is required in batch mode")
+
+    if client is None:
+        client = BlizzardClient(CLIENT_ID, SECRET, cache=ItemCache())
+
+    if item_index is None:
+        item_index, _ = build_item_index(lookup_dir)
+    if rules is None:
+        rules = load_rules()
+    owns_lookup_store = lookup_store is None
+    if owns_lookup_store:
+        lookup_store = LookupTableStore(lookup_dir)
+
+    owns_resolver = resolver is None
+    if owns_resolver:
+        resolver = IdentityResolver(roster_file)
+    log.info(f"Roster: {len(resolver.roster)} characters, {len(resolver.aliases)} aliases")
+
+    event_index = build_event_index(raid_data)
+    reader = LootExportReader(exported_data)
+    deferred = []
+    touched = {}
+    unknown_characters = 0
+
+    for row in reader:
+        character = resolver.resolve(row.character, 'loot')
+        if character is None:
+            unknown_characters += 1
+            continue
+
+        if row.item_id not in item_index:
+            deferred.append((row, character))
+            continue
 
+        current_raid, item_name = item_index[row.item_id]
         if current_raid == "Trash":
             continue
 
-        # Construct the Wowhead link
-        item_link = f"https://www.wowhead.com/classic/item={item_id}"
-
-        if item_id not in raid_data.get(character, {}).get(spec, {}):
-            if item_name:
-                # Ensure Mainspec and Offspec keys exist, even if empty
-                raid_data.setdefault(character, {"Mainspec": {}, "Offspec": {}})
-                raid_data[character][spec][item_id] = {
-                    "itemName": item_name,
-                    "itemLink": item_link,
-                    "raid": current_raid,
-                    "lootEvents": []
-                }
-            else:
-                # Ensure Mainspec and Offspec keys exist, even if empty
-                raid_data.setdefault(character, {"Mainspec": {}, "Offspec": {}})
-                raid_data[character][spec][item_id] = {
-                    "itemName": item_id,
-                    "itemLink": item_link,
-                    "raid": current_raid,
-                    "lootEvents": []
-                }
-        loot_events = raid_data[character][spec][item_id]["lootEvents"]
-        found = False
-        for event in loot_events:
-            if event["id"] == unique_id:
-                event["dateTime"] = event["dateTime"] + [date_time]
-                event["timesLooted"] += 1
-                if "raidWeek" not in event:
-                    event["raidWeek"] = []
-                event["raidWeek"].append(max_date_str)
-                found = True
-                break
-        if not found:
-            loot_events.append({"dateTime": [date_time], "timesLooted": 1, "id": unique_id, "raidWeek": [max_date_str]})
+        spec = "Offspec" if row.offspec else "Mainspec"
+        event = add_loot_event(raid_data, event_index, character, spec, row.item_id, item_name, current_raid,
+                               row.date_time, row.unique_id, None)
+        touched[id(event)] = event
+
+    max_date_str = reader.max_date
+    log.info(f"Read {reader.rows} loot rows for raid week {max_date_str}, skipped {len(reader.malformed)} malformed lines")
+
+    # Fetch every unknown item in one batch instead of one request per row
+    unknown_items = sorted({row.item_id for row, _ in deferred})
+    prefetched = client.prefetch_items(unknown_items)
+    if prefetched:
+        log.info(f"Prefetched {len(prefetched)} unknown items from the API")
+
+    try:
+        for row, character in deferred:
+            spec = "Offspec" if row.offspec else "Mainspec"
+
+            # Determine the raid and fetch item name
+            current_raid, item_name = get_item_name_and_raid(item_index, row.item_id, client, RAIDS, prefetched,
+                                                             rules, interactive, lookup_store)
+            log.debug(f"Item: {item_name} Current Raid: {current_raid}")
+
+            if current_raid is None and not interactive:
+                queue_item(pending, row.item_id, None if item_name == row.item_id else item_name, {
+                    "dateTime": row.date_time, "character": character, "spec": spec,
+                    "id": row.unique_id, "raidWeek": max_date_str,
+                })
+                continue
+
+            if current_raid == "Trash":
+                continue
+
+            add_loot_event(raid_data, event_index, character, spec, row.item_id, item_name, current_raid,
+                           row.date_time, row.unique_id, max_date_str)
+    finally:
+        # Items resolved so far are kept even if the conversion is interrupted
+        if owns_lookup_store:
+            lookup_store.flush()
+
+    for event in touched.values():
+        event["raidWeek"] = [max_date_str if week is None else week for week in event["raidWeek"]]
+
+    if client.cache is not None:
+        client.cache.save()
+        log.info(f"Item cache: {client.cache.stats()}")
+
+    if stats is not None:
+        stats.update({
+            'rows': reader.rows,
+            'malformed_rows': len(reader.malformed),
+            'unknown_character_rows': unknown_characters,
+            'lookup_table': {'hits': reader.rows - unknown_characters - len(deferred), 'misses': len(deferred),
+                             'unknown_items': len(unknown_items)},
+            'item_cache': client.cache.stats() if client.cache is not None else None,
+            'api': client.api_stats(),
+        })
+
+    if owns_resolver:
+        resolver.report()
 
     # Remove "_disenchanted" to "Disenchanted"
     if "_disenchanted" in raid_data:
@@ -136,38 +247,116 @@ def convert_txt_to_JSON(roster_file, exported_data, existing_raid_data=None):
 
     return raid_data
 
-def get_item_name_and_raid(trash_items, item_id, item_cache, access_token, raids):
+def build_event_index(raid_data):
+    """
+    Indexes every loot event in raid_data by (character, spec, item_id, id)
+    so repeat loots of an item can be found without scanning its lootEvents.
+    """
+    event_index = {}
+    for character, specs in raid_data.items():
+        for spec, items in specs.items():
+            for item_id, item_data in items.items():
+                for event in item_data["lootEvents"]:
+                    event_index[(character, spec, item_id, event["id"])] = event
+    return event_index
+
+
+def merge_raid_data(existing_raid_data, raid_data):
     """
-    Helper function to fetch the item name and determine the raid.
+    Merges newly converted raid_data into existing_raid_data, keyed on the
+    loot event id. Events that are already present are skipped, so merging
+    the same import twice leaves the data unchanged.
+
+    Args:
+        existing_raid_data: The stored raid data, updated in place.
+        raid_data: The raid data converted from the new import.
+
+    Returns:
+        The set of characters that received new loot events.
+    """
+    event_index = build_event_index(existing_raid_data)
+    affected = set()
+
+    for character, specs in raid_data.items():
+        for spec, items in specs.items():
+            for item_id, item_data in items.items():
+                for event in item_data["lootEvents"]:
+                    key = (character, spec, item_id, event["id"])
+                    if key in event_index:
+                        continue
+                    character_items = existing_raid_data.setdefault(character, {"Mainspec": {}, "Offspec": {}})
+                    spec_items = character_items.setdefault(spec, {})
+                    if item_id not in spec_items:
+                        spec_items[item_id] = {**item_data, "lootEvents": []}
+                    spec_items[item_id]["lootEvents"].append(event)
+                    event_index[key] = event
+                    affected.add(character)
+
+    return affected
+
+
+def add_loot_event(raid_data, event_index, character, spec, item_id, item_name, current_raid, date_time, unique_id,
+                   raid_week):
+    """
+    Adds a single loot row to raid_data, creating the item entry if needed,
+    and returns the loot event it was recorded on. event_index (see
+    build_event_index) is kept in sync with raid_data.
+    """
+    item_link = ITEM_LINK.format(item_id)
+
+    if item_id not in raid_data.get(character, {}).get(spec, {}):
+        # Ensure Mainspec and Offspec keys exist, even if empty
+        raid_data.setdefault(character, {"Mainspec": {}, "Offspec": {}})
+        raid_data[character][spec][item_id] = {
+            "itemName": item_name if item_name else item_id,
+            "itemLink": item_link,
+            "raid": current_raid,
+            "lootEvents": []
+        }
+    key = (character, spec, item_id, unique_id)
+    event = event_index.get(key)
+    if event is not None:
+        event["dateTime"].append(date_time)
+        event["timesLooted"] += 1
+        event.setdefault("raidWeek", []).append(raid_week)
+        return event
+    event = {"dateTime": [date_time], "timesLooted": 1, "id": unique_id, "raidWeek": [raid_week]}
+    raid_data[character][spec][item_id]["lootEvents"].append(event)
+    event_index[key] = event
+    return event
+
+
+def get_item_name_and_raid(item_index, item_id, client, raids, prefetched, rules=None, interactive=True,
+                           lookup_store=None):
+    """
+    Helper function to fetch the item name and determine the raid. New items
+    are assigned by the resolution rules first; if none matches, the raid is
+    prompted for in interactive mode and left as None in batch mode. Items
+    assigned to a raid are added to lookup_store, or written to their loot
+    table right away without one.
     """
     current_raid = None
     item_name = None
 
-    for raid in raids:
-        if item_id in item_cache[raid]:
-            # Check for item in all valid raids
-            current_raid = raid
-            item_name = item_cache[current_raid][item_id]
-        elif item_id in trash_items:
-            # Check for item in trash_items e.g. ZG
-            current_raid = "Trash"
-            item_name = trash_items[item_id]
-            print(f"Trash item found: {item_name}")
+    if item_id in item_index:
+        current_raid, item_name = item_index[item_id]
 
     if current_raid is None and item_name is None:
-        print("############", type(item_id), "#########")
+        log.debug(f"Item {item_id} is not in the lookup tables")
         # Item not found in any cache or trash_items, fetch from API
-        item_data = get_item_data(access_token, item_id)
+        if prefetched and item_id in prefetched:
+            item_data = prefetched[item_id]
+        else:
+            item_data = client.get_item_data(item_id)
         try:
             if item_data:
                 item_name = item_data["name"]
-                print(f"{item_name} fetched from API")
+                log.debug(f"{item_name} fetched from API")
 
-                # Check for the wildcard condition
-                if item_name.endswith("Qiraji Resonating Crystal"):
-                    current_raid = "AQ"
-                    print(f"Wildcard match: {item_name} assigned to AQ")
-                else:
+                current_raid = match_rule(rules or {}, 'items', item_name)
+                if current_raid:
+                    log.info(f"Rule match: {item_name} assigned to {current_raid}")
+                elif interactive:
                     valid_raids = raids
                     while True:
                         current_raid = input(f"Enter raid for item {item_id} - {item_name} (options: {', '.join(valid_raids)}): ")
@@ -176,35 +365,25 @@ def get_item_name_and_raid(trash_items, item_id, item_cache, access_token, raids
                         else:
                             print("Invalid raid. Please enter a valid option.")
 
-                if current_raid not in item_cache:
-                    item_cache[current_raid] = {}
-                item_cache[current_raid][item_id] = item_name
-
-                # Update the corresponding loot table JSON file
-                loot_table_path = os.path.join(base_dir, 'data', 'lookup_tables', f"{current_raid}_loot_table.json")
-                try:
-                    with open(loot_table_path, "r", encoding="utf-8") as f:
-                        loot_table_data = json.load(f)
-                except FileNotFoundError:
-                    loot_table_data = {}
-
-                loot_table_data[item_id] = item_name
-
-                with open(loot_table_path, "w", encoding="utf-8") as f:
-                    json.dump(loot_table_data, f, indent=4, ensure_ascii=False)
+                if current_raid:
+                    item_index[item_id] = (current_raid, item_name)
+                    # Update the corresponding loot table JSON file
+                    if lookup_store is None:
+                        lookup_store = LookupTableStore(lookup_dir, checkpoint=1)
+                    lookup_store.add(item_id, item_name, current_raid)
 
             # Print "Item not found in cache" if item_name is still None
             if item_name is None:
-                print(f"Item not found in cache for item ID {item_id}")
+                log.warning(f"Item not found in cache for item ID {item_id}")
 
             else:
-                print(f"Failed to fetch item name for item ID {item_id} from API")
+                log.debug(f"Failed to fetch item name for item ID {item_id} from API")
         except Exception as e:
-            print(f"Error fetching item data for item ID {item_id}: {e}")
+            log.error(f"Error fetching item data for item ID {item_id}: {e}")
 
     # If item_name is still None after trying the API, set it to the item_id
     if item_name is None:
         item_name = item_id  # Use item_id as a fallback
-        print(f"Using item ID {item_id} as item name")
+        log.warning(f"Using item ID {item_id} as item name")
 
     return current_raid, item_name
\ No newline at end of file
@@ -1,83 +1,226 @@
-import json
+import argparse
+import logging
 import os
 
-from loot_converter import convert_txt_to_JSON
-from softres_converter import decode_gargul_string, update_was_sr
+from dotenv import load_dotenv
+
+from run_report import RunReport, profile_file, report_file, setup_logging
+
+# The command functions import the rest, so a command only loads the modules it uses
 
 # Base directory
 base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 
 # File paths
+data_dir = os.path.join(base_dir, 'data')
 raid_file = os.path.join(base_dir, 'data', 'raid_data.json')
 softres_file = os.path.join(base_dir, 'data', 'softres_data.json')
 exported_data = os.path.join(base_dir, 'data', 'import_files', 'loot_import.txt')
 softres_export = os.path.join(base_dir, 'data', 'import_files', 'softres_import.csv')
 boss_dict = os.path.join(base_dir, 'data', 'lookup_tables', 'bosses_per_raid.json')
+backup_dir = os.path.join(base_dir, 'data', 'backups')
 roster_file = os.path.join(base_dir, 'data', 'roster.txt')
 
-# FTP credentials
-FTP_HOST = os.getenv('FTP_HOST')
-FTP_USER = os.getenv('FTP_USER')
-FTP_PASSWORD = os.getenv('FTP_PASSWORD')
-
-# Handle the softres data
-softres_data = decode_gargul_string(softres_export, boss_dict, softres_file)
-
-try:
-    with open(softres_file, 'r', encoding='utf-8') as f:
-        try:
-            existing_sr_data = json.load(f)
-        except json.JSONDecodeError:  # Handle empty JSON file
-            existing_sr_data = None
-except FileNotFoundError:
-    existing_sr_data = None
-
-# Save the JSON output to a file
-with open(softres_file, 'w', encoding='utf-8') as outfile:  # Use 'w' mode to overwrite
-    json.dump(softres_data, outfile, indent=4, ensure_ascii=False)
-
-# Handle the raid data
-raid_data = convert_txt_to_JSON(roster_file, exported_data, existing_raid_data=None)
-
-try:
-    with open(raid_file, 'r', encoding='utf-8') as f:
-        try:
-            existing_raid_data = json.load(f)
-        except json.JSONDecodeError:  # Handle empty JSON file
-            existing_raid_data = None
-except FileNotFoundError:
-    existing_raid_data = None
-
-# Merge the new raid data with the existing raid data
-if existing_raid_data:
-    for character, specs in raid_data.items():
-        if character not in existing_raid_data:
-            existing_raid_data[character] = specs
-        else:
-            for spec, items in specs.items():
-                if spec not in existing_raid_data[character]:
-                    existing_raid_data[character][spec] = items
-                else:
-                    for item_id, item_data in items.items():
-                        if item_id not in existing_raid_data[character][spec]:
-                            existing_raid_data[character][spec][item_id] = item_data
-                        else:
-                            existing_raid_data[character][spec][item_id]['lootEvents'].extend(item_data['lootEvents'])
-    raid_data = existing_raid_data
-
-# Update the raid data with the wasSr key
-updated_raid_data = update_was_sr(raid_data, softres_data)
-
-# Save the updated raid data to a file
-with open(raid_file, 'w', encoding='utf-8') as outfile:  # Use 'w' mode to overwrite
-    json.dump(updated_raid_data, outfile, indent=4, ensure_ascii=False)
-
-
-# Get the latest date from the imported loot data. This will be used to set the raidWeek value.
-#latest_date = get_latest_date_from_export(exported_data)
-
-# Update the raid data with soft-reserved information and raidWeek
-#update_raid_data_with_softres(raid_file, softres_file, latest_date)
-
-# from ftp_transfer import upload_file_to_ftp
-# upload_file_to_ftp(filename, FTP_HOST, FTP_USER, FTP_PASSWORD)
+log = logging.getLogger('main')
+
+
+def resolve(args, report):
+    from phases import publish_phases
+    from artifacts import load_json
+    from pipeline import open_store
+    from resolution import load_pending, pending_count, resolve_pending, save_pending
+    from softres_converter import update_was_sr
+
+    pending = load_pending()
+    store = open_store(raid_file, softres_file) if args.backend == 'sqlite' else None
+    if store:
+        raid_data, softres_data = store.export_raid_data(), store.export_softres_data()
+    else:
+        raid_data = load_json(raid_file) or {}
+        softres_data = load_json(softres_file) or {}
+    resolved_items, resolved_bosses = resolve_pending(pending, raid_data, softres_data, boss_dict)
+    log.info(f"Resolved {len(resolved_items)} items and {len(resolved_bosses)} bosses, "
+          f"{pending_count(pending)} still pending")
+    if resolved_items or resolved_bosses:
+        raid_data = update_was_sr(raid_data, softres_data)
+        if store:
+            store.replace_all(raid_data, softres_data)
+            store.close()
+        publish_phases(raid_data, softres_data, data_dir, full_history=store is not None)
+        save_pending(pending)
+
+
+def rebuild(args, report):
+    from artifacts import artifact_sizes
+    from ledger import file_hash, record_import, save_ledger
+    from rebuild import list_backup_weeks, rebuild_history
+    from phases import publish_phases
+    from resolution import pending_count, save_pending
+    from sqlite_store import LootStore, db_file
+
+    with report.stage('rebuild') as stage:
+        raid_data, softres_data, rebuilt_pending = rebuild_history(backup_dir, roster_file, boss_dict,
+                                                                   workers=args.workers)
+        stage['weeks'] = len(list_backup_weeks(backup_dir))
+    with report.stage('write'):
+        if args.backend == 'sqlite':
+            store = LootStore(db_file)
+            store.replace_all(raid_data, softres_data)
+            store.close()
+        publish_phases(raid_data, softres_data, data_dir, full_history=True)
+    report.set('output_bytes', artifact_sizes(data_dir))
+    # The rebuilt data replaces everything, so the queue and the ledger are replaced too
+    save_pending(rebuilt_pending)
+    ledger = {}
+    for _, loot_file, sr_file in list_backup_weeks(backup_dir):
+        if loot_file:
+            record_import(ledger, file_hash(loot_file), 'loot', loot_file)
+        if sr_file:
+            record_import(ledger, file_hash(sr_file), 'softres', sr_file)
+    save_ledger(ledger)
+    if pending_count(rebuilt_pending):
+        log.warning(f"{pending_count(rebuilt_pending)} unresolved items/bosses queued in data/pending_resolution.json")
+
+
+def run(args, report):
+    from pipeline import Pipeline
+
+    pipeline = Pipeline(data_dir, raid_file, softres_file, boss_dict, roster_file, backend=args.backend,
+                        interactive=not args.batch, engine=args.engine)
+    try:
+        pipeline.ingest(exported_data, softres_export, force=args.force, report=report)
+    finally:
+        pipeline.close()
+
+
+def site_publisher(args):
+    """
+    Returns a function that uploads the changed site files, or None if no
+    FTP server is configured.
+    """
+    from ftp_transfer import publish_site
+
+    host = os.getenv('FTP_HOST')
+    if not host and not args.dry_run:
+        log.error("FTP_HOST is not set, add the FTP details to your .env file")
+        return None
+    return lambda: publish_site(host, os.getenv('FTP_USER'), os.getenv('FTP_PASSWORD'),
+                                os.getenv('FTP_DIR', 'loothistory'), int(os.getenv('FTP_PORT', '21')),
+                                root=base_dir, force=args.force, dry_run=args.dry_run)
+
+
+def watch(args, report):
+    from pipeline import Pipeline
+    from watch import watch as watch_imports
+
+    on_publish = site_publisher(args) if args.upload else None
+    if args.upload and on_publish is None:
+        return
+    # Nobody is there to answer prompts, so unknown items and bosses are always queued
+    pipeline = Pipeline(data_dir, raid_file, softres_file, boss_dict, roster_file, backend=args.backend,
+                        interactive=False, engine=args.engine)
+    watch_imports(pipeline, exported_data, softres_export, interval=args.interval, on_publish=on_publish,
+                  report_path=args.report or report_file)
+
+
+def query(args, report):
+    from sqlite_store import LootStore, db_file
+
+    if not os.path.exists(db_file):
+        print(f"{db_file} does not exist yet, run with --backend sqlite first")
+        return
+    store = LootStore(db_file)
+    if args.query[:1] == ['who-has'] and len(args.query) == 2:
+        rows = store.who_received(args.query[1])
+        for character, spec, item_name, date_time, was_sr in rows:
+            print(f"{date_time}  {character:<14} {item_name} ({spec}{', SR' if was_sr else ''})")
+    elif args.query[:1] == ['since'] and len(args.query) in (2, 3):
+        rows = store.loot_since(*args.query[1:])
+        for character, spec, item_name, raid, date_time, was_sr in rows:
+            print(f"{date_time}  {character:<14} {item_name} [{raid}] ({spec}{', SR' if was_sr else ''})")
+    else:
+        print("Usage: main.py query who-has ITEM | main.py query since YYYY-MM-DD [CHARACTER]")
+        return
+    print(f"{len(rows)} loot events")
+    store.close()
+
+
+def analytics(args, report):
+    from frames import write_analytics
+
+    with report.stage('analytics'):
+        write_analytics(data_dir)
+
+
+def publish(args, report):
+    publish_changed = site_publisher(args)
+    if publish_changed is None:
+        return
+    with report.stage('publish') as stage:
+        stage['files'] = len(publish_changed())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process the weekly loot and soft reserve exports.")
+    parser.add_argument('command', nargs='?', default='run', choices=['run', 'watch', 'resolve', 'rebuild', 'query', 'analytics', 'publish'],
+                        help="'run' ingests the import files, 'watch' stays running and ingests them whenever they "
+                             "change, 'resolve' applies resolved entries from data/pending_resolution.json, "
+                             "'rebuild' regenerates all data from data/backups, 'query' searches the SQLite database, "
+                             "'analytics' writes soft reserve and loot statistics to data/analytics.json, "
+                             "'publish' uploads the changed site files over FTP")
+    parser.add_argument('query', nargs='*',
+                        help="For 'query': 'who-has ITEM' (ID or part of the name) or 'since YYYY-MM-DD [CHARACTER]'")
+    parser.add_argument('--backend', choices=['json', 'sqlite'], default='json',
+                        help="Where the history is kept; with 'sqlite' the JSON files are exported from data/loot_history.db")
+    parser.add_argument('--engine', choices=['python', 'pandas'], default='python',
+                        help="Convert the exports with the streaming converters or the DataFrame path "
+                             "(pandas never prompts, like --batch)")
+    parser.add_argument('--batch', action='store_true',
+                        help="Never prompt; queue unknown items and bosses in data/pending_resolution.json")
+    parser.add_argument('--force', action='store_true',
+                        help="Re-ingest the import files even if the ledger says they were already processed "
+                             "(with 'publish': upload every file)")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="With 'publish', only list the files that would be uploaded")
+    parser.add_argument('--interval', type=float, default=2.0,
+                        help="Seconds between checks of data/import_files for 'watch'")
+    parser.add_argument('--upload', action='store_true',
+                        help="With 'watch', upload the changed site files over FTP after every ingest")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Number of worker processes for 'rebuild' (defaults to the CPU count)")
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help="Show per-row details (-v) in addition to the progress summaries")
+    parser.add_argument('-q', '--quiet', action='store_true', help="Only show warnings and errors")
+    parser.add_argument('--report', default=None,
+                        help="Where to write the JSON run report (defaults to data/run_report.json)")
+    parser.add_argument('--profile', nargs='?', const=profile_file, default=None,
+                        help="Profile the whole run with cProfile and dump the stats to this file "
+                             "(defaults to data/run_profile.pstats)")
+    args = parser.parse_args()
+    setup_logging(-1 if args.quiet else args.verbose)
+    load_dotenv()
+
+    commands = {'run': run, 'watch': watch, 'resolve': resolve, 'rebuild': rebuild, 'query': query, 'analytics': analytics,
+                'publish': publish}
+    report = RunReport(args.command)
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        commands[args.command](args, report)
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            log.info(f"Profile written to {args.profile}, top functions by cumulative time:")
+            import pstats
+            pstats.Stats(profiler).sort_stats('cumulative').print_stats(15)
+    if report.data['stages']:
+        report.write(args.report or report_file)
+
+
+# The process pool used by 'rebuild' re-imports this module on platforms that spawn workers
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+import logging
+import sys
+from datetime import date
+from functools import lru_cache
+
+from artifacts import load_json
+from softres_converter import build_sr_index
+
+log = logging.getLogger(__name__)
+
+ITEM_LINK = "https://www.wowhead.com/classic/item={}"
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+@lru_cache(maxsize=None)
+def day_ordinal(value):
+    """
+    Returns the day ordinal of an ISO date string ("2025-02-09"). Anything
+    that does not round-trip exactly (timestamps, None) is returned as is,
+    interned when it is a string. Cached, so every event of a raid day
+    shares one int object.
+    """
+    if isinstance(value, str):
+        try:
+            ordinal = date.fromisoformat(value).toordinal()
+        except ValueError:
+            return sys.intern(value)
+        if date.fromordinal(ordinal).isoformat() == value:
+            return ordinal
+        return sys.intern(value)
+    return value
+
+
+@lru_cache(maxsize=None)
+def day_string(value):
+    """
+    The inverse of day_ordinal.
+    """
+    return date.fromordinal(value).isoformat() if isinstance(value, int) else value
+
+
+class Item:
+    """
+    An item as it appears in the history. Items are shared by every
+    character that looted them; the link is only stored when it is not
+    the usual Wowhead link derived from the ID.
+    """
+
+    __slots__ = ('item_id', 'name', 'raid', '_link')
+
+    def __init__(self, item_id, name, raid, link=None):
+        self.item_id = item_id
+        self.name = name
+        self.raid = raid
+        self._link = None if link == ITEM_LINK.format(item_id) else link
+
+    @property
+    def link(self):
+        return self._link or ITEM_LINK.format(self.item_id)
+
+
+class LootEvent:
+    """
+    One loot event. dates and weeks are tuples of day ordinals (see
+    day_ordinal); identical tuples are shared between events. was_sr is
+    None until the wasSr pass has seen the event.
+    """
+
+    __slots__ = ('event_id', 'dates', 'times_looted', 'weeks', 'was_sr')
+
+    def __init__(self, event_id, dates, times_looted, weeks, was_sr=None):
+        self.event_id = event_id
+        self.dates = dates
+        self.times_looted = times_looted
+        self.weeks = weeks
+        self.was_sr = was_sr
+
+
+class LootRecord:
+    """
+    The loot events of one item for one character and spec.
+    """
+
+    __slots__ = ('item', 'events')
+
+    def __init__(self, item, events=None):
+        self.item = item
+        self.events = events if events is not None else []
+
+
+class LootHistory:
+    """
+    A compact in-memory form of raid_data. Character, spec, raid and item
+    strings are interned, items are stored once, and dates are day
+    ordinals instead of repeated strings. to_raid_data() produces the
+    raid_data.json schema again, with the same key order, so
+    LootHistory.from_raid_data(d).to_raid_data() == d.
+
+    characters maps character -> spec -> item_id -> LootRecord.
+    """
+
+    def __init__(self):
+        self.characters = {}
+        self._items = {}
+        self._date_tuples = {}
+
+    def _item(self, item_id, name, raid, link):
+        key = (item_id, name, raid, link)
+        item = self._items.get(key)
+        if item is None:
+            item = self._items[key] = Item(_intern(item_id), _intern(name), _intern(raid), link)
+        return item
+
+    def _dates(self, values):
+        dates = tuple(day_ordinal(value) for value in values)
+        return self._date_tuples.setdefault(dates, dates)
+
+    def _event(self, event):
+        weeks = event.get('raidWeek')
+        return LootEvent(event['id'], self._dates(event['dateTime']), event['timesLooted'],
+                         None if weeks is None else self._dates(weeks), event.get('wasSr'))
+
+    def _record(self, character, spec, item_id, item_data):
+        specs = self.characters.setdefault(sys.intern(character), {})
+        spec_items = specs.setdefault(sys.intern(spec), {})
+        record = spec_items.get(item_id)
+        if record is None:
+            item = self._item(item_id, item_data['itemName'], item_data['raid'], item_data['itemLink'])
+            record = spec_items[item.item_id] = LootRecord(item)
+        return record
+
+    @classmethod
+    def from_raid_data(cls, raid_data):
+        history = cls()
+        for character, specs in raid_data.items():
+            for spec, items in specs.items():
+                # Characters keep their (possibly empty) Mainspec/Offspec keys
+                history.characters.setdefault(sys.intern(character), {}).setdefault(sys.intern(spec), {})
+                for item_id, item_data in items.items():
+                    record = history._record(character, spec, item_id, item_data)
+                    record.events.extend(history._event(event) for event in item_data['lootEvents'])
+        return history
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads raid_data.json, an empty history if it does not exist or is empty.
+        """
+        return cls.from_raid_data(load_json(path) or {})
+
+    def to_raid_data(self):
+        """
+        Serialises the history to the raid_data.json schema.
+        """
+        raid_data = {}
+        for character, specs in self.characters.items():
+            raid_data[character] = {}
+            for spec, items in specs.items():
+                spec_items = raid_data[character][spec] = {}
+                for item_id, record in items.items():
+                    item = record.item
+                    spec_items[item_id] = {
+                        "itemName": item.name,
+                        "itemLink": item.link,
+                        "raid": item.raid,
+                        "lootEvents": [self._event_dict(event) for event in record.events],
+                    }
+        return raid_data
+
+    @staticmethod
+    def _event_dict(event):
+        event_dict = {"dateTime": [day_string(value) for value in event.dates], "timesLooted": event.times_looted,
+                      "id": event.event_id}
+        if event.weeks is not None:
+            event_dict["raidWeek"] = [day_string(value) for value in event.weeks]
+        if event.was_sr is not None:
+            event_dict["wasSr"] = event.was_sr
+        return event_dict
+
+    def merge(self, raid_data):
+        """
+        Merges newly converted raid_data into the history, keyed on the loot
+        event id, like loot_converter.merge_raid_data.
+
+        Returns:
+            The set of characters that received new loot events.
+        """
+        affected = set()
+        for character, specs in raid_data.items():
+            for spec, items in specs.items():
+                for item_id, item_data in items.items():
+                    existing = self.characters.get(character, {}).get(spec, {}).get(item_id)
+                    known = {event.event_id for event in existing.events} if existing else set()
+                    for event in item_data['lootEvents']:
+                        if event['id'] in known:
+                            continue
+                        if character not in self.characters:
+                            self.characters[sys.intern(character)] = {"Mainspec": {}, "Offspec": {}}
+                        record = self._record(character, spec, item_id, item_data)
+                        record.events.append(self._event(event))
+                        known.add(event['id'])
+                        affected.add(character)
+        return affected
+
+    def update_was_sr(self, softres_data, characters=None):
+        """
+        Sets was_sr on every event that has not been matched to a soft
+        reserve yet, like softres_converter.update_was_sr.
+        """
+        sr_index = {key: {day_ordinal(date) for date in dates} for key, dates in build_sr_index(softres_data).items()}
+        checked = 0
+        flagged = 0
+
+        for character, specs in self.characters.items():
+            if characters is not None and character not in characters:
+                continue
+            for items in specs.values():
+                for item_id, record in items.items():
+                    softres_dates = sr_index.get((character, item_id))
+                    for event in record.events:
+                        if event.was_sr:
+                            continue
+
+                        checked += 1
+                        event.was_sr = bool(softres_dates) and any(week in softres_dates for week in event.weeks or ())
+                        if event.was_sr:
+                            flagged += 1
+
+        log.info(f"wasSr: checked {checked} loot events, {flagged} newly matched to a soft reserve")
+        return checked, flagged
@@ -0,0 +1,271 @@
+import bisect
+import hashlib
+import json
+import logging
+import os
+
+from aggregates import PHASE_START, build_summary
+from artifacts import publish_artifacts, write_compressed_variants, write_json_atomic
+from ftp_transfer import load_deploy_manifest
+from loot_converter import merge_raid_data
+from softres_converter import merge_softres_data
+
+base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+phases_file = os.path.join(base_dir, 'data', 'lookup_tables', 'phases.json')
+
+log = logging.getLogger(__name__)
+
+# Archive id of anything older than the first listed phase
+EARLIER = 'earlier'
+
+
+def load_phases(path=phases_file):
+    """
+    Loads the phase list, [{"name": ..., "start": "YYYY-MM-DD"}], sorted by
+    start. The last phase is the active one; a new phase is started by
+    adding an entry. Without the file there is a single phase starting at
+    aggregates.PHASE_START.
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            try:
+                phases = json.load(f)
+            except json.JSONDecodeError:
+                log.warning(f"Error decoding {os.path.basename(path)}. Using a single phase.")
+                phases = []
+    except FileNotFoundError:
+        phases = []
+    if not phases:
+        phases = [{'name': 'Current phase', 'start': PHASE_START}]
+    return sorted(phases, key=lambda phase: phase['start'])
+
+
+class PhaseIndex:
+    """
+    Maps dates to phase ids. A phase id is the phase's start date, or
+    EARLIER for dates before the first phase.
+    """
+
+    def __init__(self, phases):
+        self.phases = phases
+        self.starts = [phase['start'] for phase in phases]
+        self.active = self.starts[-1]
+
+    def phase_of(self, date):
+        if not date:
+            return self.active
+        position = bisect.bisect_right(self.starts, date[:10])
+        return self.starts[position - 1] if position else EARLIER
+
+    def describe(self, phase_id):
+        """
+        Returns (name, start, end) of a phase id; end is the day the next
+        phase starts.
+        """
+        if phase_id == EARLIER:
+            return 'Before the first phase', None, self.starts[0]
+        position = self.starts.index(phase_id)
+        end = self.starts[position + 1] if position + 1 < len(self.starts) else None
+        return self.phases[position].get('name', phase_id), phase_id, end
+
+
+def split_raid_data(raid_data, index):
+    """
+    Splits raid_data by the phase of each loot event's first date. Every
+    character stays in the active part, so the page lists the whole roster;
+    when all loot is in the active phase that part equals raid_data.
+
+    Returns:
+        {phase id: raid data of that phase}
+    """
+    parts = {index.active: {}}
+    for character, specs in raid_data.items():
+        active_specs = parts[index.active].setdefault(character, {})
+        for spec, items in specs.items():
+            active_specs.setdefault(spec, {})
+            for item_id, item_data in items.items():
+                for event in item_data['lootEvents']:
+                    part = parts.setdefault(index.phase_of(event['dateTime'][0]), {})
+                    spec_items = part.setdefault(character, {"Mainspec": {}, "Offspec": {}}).setdefault(spec, {})
+                    if item_id not in spec_items:
+                        spec_items[item_id] = {**item_data, "lootEvents": []}
+                    spec_items[item_id]["lootEvents"].append(event)
+    return parts
+
+
+def _split_softres_entry(entry, index):
+    """
+    Splits a soft reserve entry that spans phases by its raid dates. Each
+    reservation date goes with the first raid date on or after it.
+    """
+    weeks_by_phase = {}
+    for week in entry['raid_dates']:
+        weeks_by_phase.setdefault(index.phase_of(week), []).append(week)
+    if len(weeks_by_phase) < 2:
+        return {next(iter(weeks_by_phase), index.active): entry}
+
+    dates = entry['item_info']['Date']
+    dates_by_phase = {}
+    for date in dates if isinstance(dates, list) else [dates]:
+        week = min((week for week in entry['raid_dates'] if week >= date[:10]), default=entry['raid_dates'][-1])
+        dates_by_phase.setdefault(index.phase_of(week), []).append(date)
+
+    parts = {}
+    for phase_id, weeks in weeks_by_phase.items():
+        item_info = {**entry['item_info'], 'Date': dates_by_phase.get(phase_id, []), 'Number reserved': len(weeks)}
+        parts[phase_id] = {'item_info': item_info, 'raid_dates': weeks}
+    return parts
+
+
+def split_softres_data(softres_data, index):
+    """
+    Splits softres_data by phase of the raid dates (see split_raid_data).
+
+    Returns:
+        {phase id: soft reserve data of that phase}
+    """
+    parts = {index.active: {}}
+    for raid_instance, bosses in softres_data.items():
+        for boss, characters in bosses.items():
+            for name, items in characters.items():
+                for item, entry in items.items():
+                    for phase_id, phase_entry in _split_softres_entry(entry, index).items():
+                        part = parts.setdefault(phase_id, {})
+                        part.setdefault(raid_instance, {}).setdefault(boss, {}).setdefault(name, {})[item] = phase_entry
+    return parts
+
+
+def _load_archive_file(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _write_archive_file(out_dir, path, data, deployed):
+    content = write_json_atomic(path, data)
+    write_compressed_variants(path, content, deployed)
+    return {
+        'file': os.path.relpath(path, out_dir).replace(os.sep, '/'),
+        'bytes': len(content),
+        'sha256': hashlib.sha256(content).hexdigest(),
+    }
+
+
+def _content_hash(data):
+    content = json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    return hashlib.sha256(content).hexdigest()
+
+
+def write_archives(raid_parts, softres_parts, index, out_dir, full_history=False):
+    """
+    Writes the closed phases to out_dir/archive/<phase id>/ as minified,
+    precompressed raid_data, softres_data and summary files, and lists them
+    in out_dir/archive/manifest.json. Archives are immutable in normal use:
+    one is only written when loot of its phase shows up, e.g. after a phase
+    change or a late import.
+
+    Args:
+        raid_parts, softres_parts: The closed phases from split_raid_data
+            and split_softres_data.
+        index: The PhaseIndex.
+        out_dir: The data directory.
+        full_history: The parts hold the whole phase (e.g. after a rebuild)
+            and replace the archives, instead of being merged into them.
+
+    Returns:
+        The list of phase ids that were written.
+    """
+    archive_dir = os.path.join(out_dir, 'archive')
+    manifest_path = os.path.join(archive_dir, 'manifest.json')
+    manifest = _load_archive_file(manifest_path) or {'phases': {}}
+    deployed = load_deploy_manifest()
+
+    written = []
+    for phase_id in sorted(set(raid_parts) | set(softres_parts)):
+        phase_dir = os.path.join(archive_dir, phase_id)
+        raid_path = os.path.join(phase_dir, 'raid_data.min.json')
+        softres_path = os.path.join(phase_dir, 'softres_data.min.json')
+        raid_data = raid_parts.get(phase_id, {})
+        softres_data = softres_parts.get(phase_id, {})
+        entry = manifest['phases'].get(phase_id)
+
+        if full_history:
+            if entry and (entry['raid_data']['sha256'], entry['softres_data']['sha256']) == (
+                    _content_hash(raid_data), _content_hash(softres_data)):
+                continue
+        else:
+            if entry:
+                log.warning(f"Loot or soft reserves for the closed phase {phase_id} found, reopening its archive")
+            archived_raid_data = _load_archive_file(raid_path)
+            merge_raid_data(archived_raid_data, raid_data)
+            raid_data = archived_raid_data
+            softres_data = merge_softres_data(_load_archive_file(softres_path), softres_data)
+
+        name, start, end = index.describe(phase_id)
+        manifest['phases'][phase_id] = {
+            'name': name,
+            'start': start,
+            'end': end,
+            'characters': len(raid_data),
+            'raid_data': _write_archive_file(out_dir, raid_path, raid_data, deployed),
+            'softres_data': _write_archive_file(out_dir, softres_path, softres_data, deployed),
+            'summary': _write_archive_file(out_dir, os.path.join(phase_dir, 'summary.min.json'),
+                                           build_summary(raid_data, phase_start=start or ''), deployed),
+        }
+        written.append(phase_id)
+        log.info(f"Archived phase {phase_id} ({len(raid_data)} characters)")
+
+    if written:
+        manifest['phases'] = dict(sorted(manifest['phases'].items()))
+        content = write_json_atomic(manifest_path, manifest, indent=2)
+        write_compressed_variants(manifest_path, content, deployed)
+    return written
+
+
+def load_archived_data(out_dir):
+    """
+    Loads every archived phase and returns them merged, as a tuple
+    (raid_data, softres_data). Only needed for all-time views such as
+    the SQLite database.
+    """
+    archive_dir = os.path.join(out_dir, 'archive')
+    manifest = _load_archive_file(os.path.join(archive_dir, 'manifest.json')) or {'phases': {}}
+    raid_data, softres_data = {}, {}
+    for phase_id in sorted(manifest['phases']):
+        merge_raid_data(raid_data, _load_archive_file(os.path.join(archive_dir, phase_id, 'raid_data.min.json')))
+        merge_softres_data(softres_data, _load_archive_file(os.path.join(archive_dir, phase_id, 'softres_data.min.json')))
+    return raid_data, softres_data
+
+
+def publish_phases(raid_data, softres_data, out_dir, full_history=False, phases=None):
+    """
+    Splits the data by phase, archives the closed phases (see
+    write_archives) and publishes the active phase with publish_artifacts,
+    so raid_data.json, softres_data.json and the shards only hold the
+    active phase and stay the same size as phases accumulate.
+
+    Args:
+        raid_data: The raid data, the active phase plus whatever belongs
+            to closed phases.
+        softres_data: The soft reserve data, likewise.
+        out_dir: The data directory.
+        full_history: See write_archives.
+        phases: The phase list, load_phases() by default.
+
+    Returns:
+        A tuple (manifest, raid_data, softres_data, archived) with the
+        publish_artifacts manifest, the active phase data and the list of
+        archived phase ids.
+    """
+    index = PhaseIndex(phases or load_phases())
+    raid_parts = split_raid_data(raid_data, index)
+    softres_parts = split_softres_data(softres_data, index)
+    active_raid_data = raid_parts.pop(index.active)
+    active_softres_data = softres_parts.pop(index.active)
+
+    archived = write_archives(raid_parts, softres_parts, index, out_dir, full_history) if (
+        raid_parts or softres_parts) else []
+    manifest = publish_artifacts(active_raid_data, active_softres_data, out_dir, phase_start=index.active)
+    return manifest, active_raid_data, active_softres_data, archived
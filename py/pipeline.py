@@ -0,0 +1,271 @@
+import glob
+import logging
+import os
+
+from artifacts import artifact_sizes, load_json
+from blizz_item_fetch import BlizzardClient, ItemCache, CLIENT_ID, SECRET
+from identity import IdentityResolver, aliases_file
+from ledger import file_hash, is_ingested, load_ledger, record_import, save_ledger
+from loot_converter import build_item_index, convert_txt_to_JSON, lookup_dir, merge_raid_data
+from model import LootHistory
+from phases import load_archived_data, publish_phases
+from resolution import load_pending, load_rules, pending_count, save_pending
+from run_report import RunReport
+from softres_converter import copy_for_merge, decode_gargul_string, merge_softres_data
+from sqlite_store import LootStore, db_file
+
+log = logging.getLogger(__name__)
+
+
+def open_store(raid_file, softres_file, path=db_file):
+    """
+    Opens the SQLite database at path. The first time it is used it is
+    filled from the existing JSON files and the archived phases.
+    """
+    store = LootStore(path)
+    if store.is_empty() and os.path.exists(raid_file):
+        log.info(f"Importing {os.path.basename(raid_file)} and {os.path.basename(softres_file)} into {os.path.basename(path)}")
+        raid_data = load_json(raid_file) or {}
+        softres_data = load_json(softres_file) or {}
+        archived_raid_data, archived_softres_data = load_archived_data(os.path.dirname(raid_file))
+        if archived_raid_data or archived_softres_data:
+            merge_raid_data(archived_raid_data, raid_data)
+            for character in raid_data:
+                archived_raid_data.setdefault(character, {"Mainspec": {}, "Offspec": {}})
+            raid_data = archived_raid_data
+            softres_data = merge_softres_data(archived_softres_data, softres_data)
+        store.replace_all(raid_data, softres_data)
+    return store
+
+
+class Pipeline:
+    """
+    Ingests loot and soft reserve exports and publishes the result. The
+    state an ingest needs (the loot history as a compact LootHistory or
+    the SQLite store, the soft reserve data, the item index and resolution
+    rules, the roster, the API client with its token and item cache) is
+    loaded on the first ingest and kept, so a resident process only pays
+    for the new export on later ingests. Anything that changes on disk
+    behind its back, e.g. a 'resolve' run or an edited lookup table, is
+    reloaded before the next ingest.
+
+    With engine='pandas' the exports are converted, and the wasSr pass of
+    the JSON backend is run, by the DataFrame path in frames.py, which
+    never prompts.
+    """
+
+    def __init__(self, data_dir, raid_file, softres_file, boss_dict, roster_file, backend='json', interactive=True,
+                 engine='python', db_path=db_file):
+        self.data_dir = data_dir
+        self.raid_file = raid_file
+        self.softres_file = softres_file
+        self.boss_dict = boss_dict
+        self.roster_file = roster_file
+        self.backend = backend
+        self.db_path = db_path
+        self.engine = engine
+        self.interactive = interactive and engine == 'python'
+
+        self.store = None
+        self.history = None
+        self.softres_data = None
+        self.item_index = None
+        self.rules = None
+        self.resolver = None
+        self.client = None
+        self._mtimes = {}
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+
+    def _file_mtimes(self):
+        paths = [self.roster_file] + sorted(glob.glob(os.path.join(lookup_dir, '*.json')))
+        if self.backend == 'sqlite':
+            paths.append(self.db_path)
+        else:
+            paths += [self.raid_file, self.softres_file]
+        return {path: os.path.getmtime(path) if os.path.exists(path) else None for path in paths}
+
+    def _load(self):
+        """
+        Loads whatever is missing or changed on disk since the last ingest.
+        """
+        current = self._file_mtimes()
+        changed = {path for path, mtime in current.items() if self._mtimes.get(path, -1) != mtime}
+        if not changed:
+            return
+
+        if self.backend == 'sqlite':
+            if self.store is None:
+                self.store = open_store(self.raid_file, self.softres_file, self.db_path)
+        elif self.history is None or {self.raid_file, self.softres_file} & changed:
+            self.history = LootHistory.load(self.raid_file)
+            self.softres_data = load_json(self.softres_file) or {}
+            log.info(f"Loaded {len(self.history.characters)} characters from {os.path.basename(self.raid_file)}")
+
+        if self.resolver is None or {self.roster_file, aliases_file} & changed:
+            self.resolver = IdentityResolver(self.roster_file)
+
+        if self.item_index is None or any(path.startswith(lookup_dir) for path in changed):
+            self.item_index, _ = build_item_index(lookup_dir)
+            self.rules = load_rules()
+
+        if self.client is None:
+            self.client = BlizzardClient(CLIENT_ID, SECRET, cache=ItemCache())
+
+        self._mtimes = current
+
+    def process(self, loot_export, softres_export, report):
+        """
+        Converts the given exports (None for one that is skipped), merges
+        them and publishes the result. The ledger is neither checked nor
+        updated and the pending queue is not saved, ingest() does that.
+
+        Args:
+            loot_export: The loot export, or None.
+            softres_export: The Gargul soft reserve export, or None.
+            report: A RunReport, or anything with the same stage() and
+                set() methods.
+
+        Returns:
+            The pending-resolution queue, to be saved once the ingest is
+            recorded.
+        """
+        new_sr = softres_export is not None
+        new_loot = loot_export is not None
+        self._load()
+        if self.engine == 'pandas':
+            import frames
+        pending = load_pending()
+        # Unknown names are reported per ingest
+        self.resolver.unknown.clear()
+
+        # Handle the softres data
+        with report.stage('sr_decode') as stage:
+            if new_sr and self.engine == 'pandas':
+                new_softres_data = frames.decode_softres_export(softres_export, self.boss_dict, pending=pending,
+                                                                resolver=self.resolver, stats=stage)
+            elif new_sr:
+                new_softres_data = decode_gargul_string(softres_export, self.boss_dict, interactive=self.interactive,
+                                                        pending=pending, resolver=self.resolver, stats=stage)
+            else:
+                log.info("Soft reserve import already ingested, skipping")
+                new_softres_data = {}
+
+        # Handle the raid data
+        loot_stats = {}
+        with report.stage('loot_convert') as stage:
+            if new_loot and self.engine == 'pandas':
+                new_raid_data = frames.convert_loot_export(self.roster_file, loot_export, client=self.client,
+                                                           pending=pending, resolver=self.resolver, stats=loot_stats,
+                                                           item_index=self.item_index, rules=self.rules)
+                stage['rows'] = loot_stats['rows']
+            elif new_loot:
+                new_raid_data = convert_txt_to_JSON(self.roster_file, loot_export, client=self.client,
+                                                    interactive=self.interactive, pending=pending,
+                                                    resolver=self.resolver, stats=loot_stats,
+                                                    item_index=self.item_index, rules=self.rules)
+                stage['rows'] = loot_stats['rows']
+            else:
+                log.info("Loot import already ingested, skipping")
+                new_raid_data = {}
+        report.set('lookup_table', loot_stats.get('lookup_table'))
+        report.set('item_cache', loot_stats.get('item_cache'))
+        report.set('api', loot_stats.get('api'))
+
+        self.resolver.report()
+        report.set('unknown_names', dict(self.resolver.unknown))
+
+        if self.store is not None:
+            with report.stage('merge'):  # Includes the wasSr update, which runs in SQL
+                affected_characters = self.store.ingest(new_raid_data, new_softres_data)
+                raid_data, softres_data = self.store.export_raid_data(), self.store.export_softres_data()
+        else:
+            # Merge the new data into the current data, skipping loot events that are already present
+            # New soft reserves are merged into a copy of the entries they touch, which replaces
+            # the warm state once published
+            with report.stage('merge'):
+                softres_data = self.softres_data
+                if new_softres_data:
+                    softres_data = merge_softres_data(copy_for_merge(softres_data, new_softres_data), new_softres_data)
+                affected_characters = self.history.merge(new_raid_data)
+            log.info(f"Merged new loot for {len(affected_characters)} characters")
+
+            # Update the raid data with the wasSr key. New soft reserves can match loot of any
+            # character, otherwise only characters with new loot need checking.
+            with report.stage('was_sr'):
+                characters = None if new_sr else affected_characters
+                if self.engine == 'pandas':
+                    raid_data = frames.update_was_sr(self.history.to_raid_data(), softres_data, characters=characters)
+                    self.history = LootHistory.from_raid_data(raid_data)
+                else:
+                    self.history.update_was_sr(softres_data, characters=characters)
+                    raid_data = self.history.to_raid_data()
+        report.set('affected_characters', len(affected_characters))
+
+        # Save the active phase as the full documents plus the minified, sharded and compressed
+        # artifacts, and move loot of closed phases to their archives
+        with report.stage('write'):
+            manifest, raid_data, softres_data, archived = publish_phases(raid_data, softres_data, self.data_dir,
+                                                                          full_history=self.store is not None)
+        if self.store is None:
+            self.softres_data = softres_data
+            if archived:
+                # Keep only the active phase in memory, like the files on disk
+                self.history = LootHistory.from_raid_data(raid_data)
+        log.info(f"Published {len(manifest['raids'])} raid shards and {len(manifest['softres'])} soft reserve shards")
+        report.set('output_bytes', artifact_sizes(self.data_dir))
+        return pending
+
+    def ingest(self, loot_export, softres_export, force=False, report=None):
+        """
+        Ingests the given exports unless the ledger says they were already
+        processed, and publishes the artifacts.
+
+        Args:
+            loot_export: The loot export to ingest.
+            softres_export: The Gargul soft reserve export to ingest.
+            force: Ingest even if the ledger lists the files.
+            report: A RunReport to record the stages in.
+
+        Returns:
+            True if anything was ingested.
+        """
+        report = report or RunReport('ingest')
+        ledger = load_ledger()
+        loot_hash = file_hash(loot_export)
+        sr_hash = file_hash(softres_export)
+        new_sr = sr_hash is not None and (force or not is_ingested(ledger, sr_hash))
+        new_loot = loot_hash is not None and (force or not is_ingested(ledger, loot_hash))
+
+        if not new_sr and not new_loot:
+            log.info("Both import files have already been ingested, nothing to do (use --force to re-run)")
+            return False
+
+        try:
+            pending = self.process(loot_export if new_loot else None, softres_export if new_sr else None, report)
+        except Exception:
+            log.error("Ingest failed, the import files are not recorded in the ledger and are retried on the next run")
+            # The loot history may hold part of the failed ingest, reload it from disk next time
+            self.history = None
+            self._mtimes = {}
+            raise
+
+        # Only imports that were decoded and published cleanly are recorded
+        if new_sr:
+            record_import(ledger, sr_hash, 'softres', softres_export)
+        if new_loot:
+            record_import(ledger, loot_hash, 'loot', loot_export)
+        save_ledger(ledger)
+
+        if not self.interactive:
+            save_pending(pending)
+            if pending_count(pending):
+                log.warning(f"{pending_count(pending)} unresolved items/bosses queued in data/pending_resolution.json, "
+                            f"set their 'raid' and run 'python py/main.py resolve'")
+
+        # Our own writes are not changes to reload
+        self._mtimes = self._file_mtimes()
+        return True
@@ -0,0 +1,121 @@
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from blizz_item_fetch import BlizzardClient, ItemCache, CLIENT_ID, SECRET
+from identity import IdentityResolver
+from loot_converter import (RAIDS, LootExportReader, build_item_index, convert_txt_to_JSON, get_item_name_and_raid,
+                            lookup_dir, merge_raid_data)
+from lookup_store import LookupTableStore
+from resolution import load_rules
+from softres_converter import decode_gargul_string, merge_softres_data, update_was_sr
+
+log = logging.getLogger(__name__)
+
+
+def list_backup_weeks(backup_dir):
+    """
+    Pairs the weekly exports in backup_dir/Loot and backup_dir/SR by file
+    name. Returns a sorted list of (week, loot_file, sr_file) where either
+    file may be None if that week only has one of them.
+    """
+    weeks = {}
+    for kind in ('Loot', 'SR'):
+        kind_dir = os.path.join(backup_dir, kind)
+        if not os.path.isdir(kind_dir):
+            continue
+        for week in os.listdir(kind_dir):
+            weeks.setdefault(week, {})[kind] = os.path.join(kind_dir, week)
+    return [(week, files.get('Loot'), files.get('SR')) for week, files in sorted(weeks.items())]
+
+
+def resolve_unknown_items(loot_files):
+    """
+    Looks up every item in loot_files that is missing from the lookup tables
+    and applies the resolution rules to it, before any worker starts. The
+    workers then only read the lookup tables. Items that cannot be resolved
+    are queued by the workers as usual.
+    """
+    item_index, _ = build_item_index(lookup_dir)
+    unknown_items = sorted({row.item_id for path in loot_files for row in LootExportReader(path)
+                            if row.item_id not in item_index})
+    if not unknown_items:
+        return
+
+    rules = load_rules()
+    client = BlizzardClient(CLIENT_ID, SECRET, cache=ItemCache())
+    prefetched = client.prefetch_items(unknown_items)
+    lookup_store = LookupTableStore(lookup_dir, checkpoint=None)
+    for item_id in unknown_items:
+        get_item_name_and_raid(item_index, item_id, client, RAIDS, prefetched, rules, interactive=False,
+                               lookup_store=lookup_store)
+    lookup_store.flush()
+    client.cache.save()
+
+
+def rebuild_week(week, loot_file, sr_file, roster_file, boss_dict):
+    """
+    Converts one week of backups on its own. Runs in a worker process.
+    """
+    pending = {'items': {}, 'bosses': {}}
+    softres_data = {}
+    raid_data = {}
+    resolver = IdentityResolver(roster_file)
+    if sr_file:
+        softres_data = decode_gargul_string(sr_file, boss_dict, interactive=False, pending=pending, resolver=resolver)
+    if loot_file:
+        raid_data = convert_txt_to_JSON(roster_file, loot_file, interactive=False, pending=pending, resolver=resolver)
+    resolver.report()
+    return week, raid_data, softres_data, pending
+
+
+def merge_pending(pending, week_pending):
+    for kind in ('items', 'bosses'):
+        for key, entry in week_pending[kind].items():
+            if key not in pending[kind]:
+                pending[kind][key] = entry
+                continue
+            target = pending[kind][key]
+            for field in ('items', 'rows'):
+                for value in entry.get(field, []):
+                    if value not in target[field]:
+                        target[field].append(value)
+
+
+def rebuild_history(backup_dir, roster_file, boss_dict, workers=None):
+    """
+    Rebuilds the raid and soft reserve data from the weekly backups. Weeks
+    are converted in parallel in a process pool and then merged in week
+    order, so the result does not depend on the number of workers.
+
+    Args:
+        backup_dir: The directory containing the Loot and SR backup folders.
+        roster_file: The path to the roster.
+        boss_dict: The path to bosses_per_raid.json.
+        workers: Number of worker processes, defaults to the CPU count.
+
+    Returns:
+        A tuple (raid_data, softres_data, pending).
+    """
+    weeks = list_backup_weeks(backup_dir)
+    if not weeks:
+        log.warning(f"No backups found in {backup_dir}")
+        return {}, {}, {'items': {}, 'bosses': {}}
+    resolve_unknown_items([loot_file for _, loot_file, _ in weeks if loot_file])
+
+    raid_data = {}
+    softres_data = {}
+    pending = {'items': {}, 'bosses': {}}
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(rebuild_week, *zip(*[(week, loot_file, sr_file, roster_file, boss_dict)
+                                                     for week, loot_file, sr_file in weeks]))
+        # map() yields in submission order, which keeps the merge deterministic
+        for week, week_raid_data, week_softres_data, week_pending in results:
+            merge_softres_data(softres_data, week_softres_data)
+            merge_raid_data(raid_data, week_raid_data)
+            merge_pending(pending, week_pending)
+            log.info(f"Merged week {week}")
+
+    update_was_sr(raid_data, softres_data)
+    return raid_data, softres_data, pending
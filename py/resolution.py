@@ -0,0 +1,167 @@
+import json
+import logging
+import os
+
+from artifacts import write_atomic
+from lookup_store import LookupTableStore
+
+base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+rules_file = os.path.join(base_dir, 'data', 'lookup_tables', 'resolution_rules.json')
+pending_file = os.path.join(base_dir, 'data', 'pending_resolution.json')
+
+log = logging.getLogger(__name__)
+
+MATCHERS = {
+    'exact': lambda value, pattern: value == pattern,
+    'prefix': lambda value, pattern: value.startswith(pattern),
+    'suffix': lambda value, pattern: value.endswith(pattern),
+    'contains': lambda value, pattern: pattern in value,
+}
+
+
+def load_rules(path=rules_file):
+    """
+    Loads the raid resolution rules. The file holds an 'items' and a 'bosses'
+    list, each rule being {"match": "exact|prefix|suffix|contains",
+    "pattern": ..., "raid": ...}.
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            try:
+                rules = json.load(f)
+            except json.JSONDecodeError:
+                log.warning(f"Error decoding {os.path.basename(path)}. Using no resolution rules.")
+                rules = {}
+    except FileNotFoundError:
+        rules = {}
+    rules.setdefault('items', [])
+    rules.setdefault('bosses', [])
+    return rules
+
+
+def match_rule(rules, kind, value):
+    """
+    Returns the raid of the first rule of the given kind ('items' or 'bosses')
+    matching value, or None.
+    """
+    if not value:
+        return None
+    for rule in rules.get(kind, []):
+        if MATCHERS[rule.get('match', 'exact')](value, rule['pattern']):
+            return rule['raid']
+    return None
+
+
+def load_pending(path=pending_file):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            try:
+                pending = json.load(f)
+            except json.JSONDecodeError:
+                log.warning(f"Error decoding {os.path.basename(path)}. Starting with an empty queue.")
+                pending = {}
+    except FileNotFoundError:
+        pending = {}
+    pending.setdefault('items', {})
+    pending.setdefault('bosses', {})
+    return pending
+
+
+def save_pending(pending, path=pending_file):
+    with open(path, 'w', encoding='utf-8') as outfile:
+        json.dump(pending, outfile, indent=4, ensure_ascii=False)
+
+
+def queue_item(pending, item_id, item_name, loot_row):
+    """
+    Queues a loot row whose item could not be assigned to a raid. Set the
+    entry's 'raid' in the pending file and run the resolve step to apply it.
+    """
+    entry = pending['items'].setdefault(item_id, {'itemName': item_name, 'raid': None, 'rows': []})
+    if loot_row not in entry['rows']:
+        entry['rows'].append(loot_row)
+
+
+def queue_boss(pending, boss, item, sr_row):
+    """
+    Queues a soft reserve row whose boss is not in bosses_per_raid.json.
+    """
+    entry = pending['bosses'].setdefault(boss, {'raid': None, 'items': [], 'rows': []})
+    if item not in entry['items']:
+        entry['items'].append(item)
+    if sr_row not in entry['rows']:
+        entry['rows'].append(sr_row)
+
+
+def pending_count(pending):
+    return len(pending['items']) + len(pending['bosses'])
+
+
+def resolve_pending(pending, raid_data, softres_data, boss_dict):
+    """
+    Applies every pending entry that has been given a 'raid'. Resolved items
+    are written to their loot table and their queued loot rows are added to
+    raid_data; resolved bosses are added to bosses_per_raid.json and their
+    queued rows are added to softres_data. Only the queued records are
+    touched. Resolved entries are removed from pending. An entry whose
+    'raid' is not a known raid (or "Trash" for items) is left in the queue
+    with a warning, so a typo never creates a new loot table or raid.
+
+    Args:
+        pending: The pending-resolution queue.
+        raid_data: The existing raid data, updated in place.
+        softres_data: The existing soft reserve data, updated in place.
+        boss_dict: The path to bosses_per_raid.json.
+
+    Returns:
+        A tuple (resolved_items, resolved_bosses) with the resolved keys.
+    """
+    # Imported here as both converters import this module
+    from loot_converter import RAIDS, add_loot_event, build_event_index
+    from softres_converter import add_softres_row
+
+    event_index = build_event_index(raid_data)
+    lookup_store = LookupTableStore(checkpoint=None)
+    resolved_items = []
+    for item_id, entry in list(pending['items'].items()):
+        raid = entry.get('raid')
+        if not raid:
+            continue
+        if raid not in RAIDS and raid != "Trash":
+            log.warning(f"Pending item {item_id} has unknown raid '{raid}' (options: {', '.join(RAIDS + ['Trash'])}), "
+                        f"left in the queue")
+            continue
+        item_name = entry.get('itemName') or item_id
+        lookup_store.add(item_id, item_name, raid)
+        if raid != "Trash":
+            for row in entry['rows']:
+                add_loot_event(raid_data, event_index, row['character'], row['spec'], item_id, item_name, raid,
+                               row['dateTime'], row['id'], row['raidWeek'])
+        del pending['items'][item_id]
+        resolved_items.append(item_id)
+    lookup_store.flush()
+
+    resolved_bosses = []
+    for boss, entry in pending['bosses'].items():
+        if entry.get('raid') and entry['raid'] not in RAIDS:
+            log.warning(f"Pending boss '{boss}' has unknown raid '{entry['raid']}' (options: {', '.join(RAIDS)}), "
+                        f"left in the queue")
+    if any(entry.get('raid') in RAIDS for entry in pending['bosses'].values()):
+        with open(boss_dict, 'r', encoding='utf-8') as f:
+            boss_data = json.load(f)
+
+        for boss, entry in list(pending['bosses'].items()):
+            raid = entry.get('raid')
+            if raid not in RAIDS:
+                continue
+            boss_names = boss_data.setdefault(raid, {'boss_names': []})['boss_names']
+            if boss not in boss_names:
+                boss_names.append(boss)
+            for row in entry['rows']:
+                add_softres_row(softres_data, raid, boss, row['name'], dict(row['row']), row['raidWeek'])
+            del pending['bosses'][boss]
+            resolved_bosses.append(boss)
+
+        write_atomic(boss_dict, (json.dumps(boss_data, indent=2, ensure_ascii=False) + '\n').encode('utf-8'))
+
+    return resolved_items, resolved_bosses
@@ -0,0 +1,68 @@
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+report_file = os.path.join(base_dir, 'data', 'run_report.json')
+profile_file = os.path.join(base_dir, 'data', 'run_profile.pstats')
+
+log = logging.getLogger(__name__)
+
+
+def setup_logging(verbosity=0):
+    """
+    Configures logging for a run. verbosity is -1 (warnings and errors
+    only), 0 (progress summaries) or 1+ (per-row details, with timestamps
+    and module names).
+    """
+    if verbosity < 0:
+        level = logging.WARNING
+    elif verbosity == 0:
+        level = logging.INFO
+    else:
+        level = logging.DEBUG
+    fmt = '%(asctime)s %(levelname)s %(name)s: %(message)s' if verbosity > 0 else '%(message)s'
+    logging.basicConfig(level=level, format=fmt, force=True)
+
+
+class RunReport:
+    """
+    Collects stage timings and counters for one run and writes them as JSON.
+    Use stage() around each pipeline step; a stage given a row count also
+    reports rows per second.
+    """
+
+    def __init__(self, command):
+        self.started = time.time()
+        self.data = {
+            'command': command,
+            'started': datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+            'stages': {},
+        }
+
+    @contextmanager
+    def stage(self, name):
+        info = {}
+        start = time.perf_counter()
+        try:
+            yield info
+        finally:
+            info['seconds'] = round(time.perf_counter() - start, 4)
+            if info.get('rows') and info['seconds'] > 0:
+                info['rows_per_sec'] = round(info['rows'] / info['seconds'], 1)
+            self.data['stages'][name] = info
+            log.debug(f"Stage {name}: {info}")
+
+    def set(self, key, value):
+        self.data[key] = value
+
+    def write(self, path=report_file):
+        self.data['total_seconds'] = round(time.time() - self.started, 4)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as outfile:
+            json.dump(self.data, outfile, indent=2)
+            outfile.write('\n')
+        log.info(f"Run report written to {os.path.relpath(path, base_dir)} ({self.data['total_seconds']}s)")
@@ -1,8 +1,17 @@
+import copy
 import csv
 import json
+import logging
 from datetime import datetime
 
-def decode_gargul_string(softres_export, boss_dict, softres_file=None):
+from identity import IdentityResolver
+from resolution import load_rules, match_rule, queue_boss
+
+log = logging.getLogger(__name__)
+
+
+def decode_gargul_string(softres_export, boss_dict, softres_file=None, interactive=True, pending=None, resolver=None,
+                         stats=None):
     """
     Reads a CSV file, extracts data from all columns (excluding 'Note',
     'Discord ID', and 'Plus'), handles duplicate 'Name' entries by adding
@@ -14,18 +23,35 @@ def decode_gargul_string(softres_export, boss_dict, softres_file=None):
     only if the dates are different. Updates the outer 'raid_dates' list
     with the maximum date from the new import if the minimum date in the
     new import is greater than the current maximum in 'raid_dates'.
-    Optionally loads existing data from a JSON file.
+    Optionally loads existing data from a JSON file. Rows whose boss is
+    unknown are assigned by the resolution rules; failing that they are
+    prompted for, or in batch mode (interactive=False) queued in pending.
+    Names go through the same identity resolver as the loot export, but
+    reservations by characters that are not on the roster are kept.
+    The whole export is validated before anything is added; a row with a
+    malformed Date raises ValueError and leaves the data untouched.
 
     Args:
         softres_export: The path to the CSV file.
         boss_dict: The path to the JSON file containing boss names for
                    raid instances.
         softres_file: Optional path to a JSON file containing existing data.
+        interactive: Whether to prompt for unknown bosses.
+        pending: The pending-resolution queue, required in batch mode.
+        resolver: The identity.IdentityResolver shared with the loot
+                  conversion, one is built from the roster if omitted.
+        stats: Optional dictionary that receives the row counts.
 
     Returns:
         A dictionary with the specified structure.
     """
 
+    if not interactive and pending is None:
+        raise ValueError("A pending-resolution queue is required in batch mode")
+    rules = load_rules()
+    if resolver is None:
+        resolver = IdentityResolver()
+
     try:
         with open(boss_dict, 'r', encoding='utf-8') as f:
             try:
@@ -42,167 +68,274 @@ def decode_gargul_string(softres_export, boss_dict, softres_file=None):
             with open(softres_file, 'r', encoding='utf-8') as f:
                 data = json.load(f)
         except FileNotFoundError:
-            print(f"Error: Existing data file not found at {softres_file}")
+            log.error(f"Error: Existing data file not found at {softres_file}")
         except json.JSONDecodeError:
-            print(f"Error: Invalid JSON format in {softres_file}")
+            log.error(f"Error: Invalid JSON format in {softres_file}")
 
+    # Boss -> raid instance, the first instance listing a boss wins as before
+    boss_index = {}
+    for instance, bosses in (boss_data or {}).items():
+        for boss_name in bosses['boss_names']:
+            boss_index.setdefault(boss_name, instance)
+
+    # The export is read and validated in full before anything is added to
+    # data, so a malformed row leaves the existing data untouched
+    parsed_rows = []
     try:
         with open(softres_export, 'r', encoding='utf-8') as csvfile:
             reader = csv.DictReader(csvfile)
+            missing = [column for column in ('Name', 'Item', 'From', 'Date') if column not in (reader.fieldnames or [])]
+            if reader.fieldnames and missing:
+                raise ValueError(f"{softres_export} is missing the columns {', '.join(missing)}")
+            for line_no, row in enumerate(reader, start=2):
+                try:
+                    current_date = datetime.strptime(row['Date'] or '', "%Y-%m-%d %H:%M:%S")
+                except ValueError:
+                    raise ValueError(f"Malformed Date on line {line_no} of {softres_export}: {row['Date']!r}") from None
+                parsed_rows.append((row, current_date))
+    except FileNotFoundError:
+        log.error(f"Error: CSV file not found at {softres_export}")
+    except Exception as e:
+        log.error(f"Error reading or processing CSV data: {e}")
+        raise
 
-            # Find the max date in the new import
-            max_date_import = None
-            for row in reader:
-                date_str = row['Date']
-                current_date = datetime.strptime(date_str, "%Y-%m-%d %H:%M:%S")
-                if max_date_import is None or current_date > max_date_import:
-                    max_date_import = current_date
+    rows = len(parsed_rows)
+    max_date_import = max((current_date for _, current_date in parsed_rows), default=None)
+    # The raid week, already in YYYY-MM-DD format
+    max_date_str = max_date_import.strftime("%Y-%m-%d") if max_date_import else None
 
-            max_date_str = max_date_import.strftime("%Y-%m-%d") if max_date_import else None
+    queued_rows = []
+    date_sets = {}
+    # Initialize prompted_instances here, outside the loop
+    prompted_instances = {}
 
-            csvfile.seek(0)
-            reader = csv.DictReader(csvfile)
+    for row, _ in parsed_rows:
+        raw_name = row.pop('Name')
+        name = resolver.resolve(raw_name, 'softres') or resolver.canonical(raw_name)
+        item = row['Item']
+        boss = row['From']  # Assuming 'From' field indicates the boss
 
-            # Initialize prompted_instances here, outside the loop
-            prompted_instances = {}
-
-            for row in reader:
-                name = row.pop('Name')
-                item = row['Item']
-                boss = row['From']  # Assuming 'From' field indicates the boss
-
-                # Remove unnecessary keys
-                row.pop('Note', None)
-                row.pop('Discord ID', None)
-                row.pop('Plus', None)
-
-                # Find the raid instance based on the boss
-                raid_instance = None
-                if boss_data:
-                    for instance, bosses in boss_data.items():
-                        if boss in bosses['boss_names']:
-                            raid_instance = instance
-                            break
-                
-                if raid_instance is None and item.startswith("Desecrated"):
-                    raid_instance = "Naxx"
-                    
-                if raid_instance is None:
-                    # Use the dictionary to store prompted raid instances
-                    if item in prompted_instances:
-                        raid_instance = prompted_instances[item]
-                    else:
-                        # Prompt for raid instance
-                        print(f"Warning: Boss '{boss}' not found in any raid instance.")
-                        while raid_instance is None:
-                            if boss_data:
-                                print("Available raid instances:")
-                                for instance in boss_data.keys():
-                                    print(f"- {instance}")
-                            raid_instance = input(f"Enter the correct raid instance for '{item}': ")
-                            if raid_instance not in boss_data:
-                                print("Invalid raid instance. Please try again.")
-                                raid_instance = None  # Reset to None for the loop
-                        # Store the prompted instance
-                        prompted_instances[item] = raid_instance
-                    continue
+        # Remove unnecessary keys
+        row.pop('Note', None)
+        row.pop('Discord ID', None)
+        row.pop('Plus', None)
 
-                # Structure data by raid instance and boss
-                if raid_instance not in data:
-                    data[raid_instance] = {}
-                if boss not in data[raid_instance]:
-                    data[raid_instance][boss] = {}
-                if name not in data[raid_instance][boss]:
-                    data[raid_instance][boss][name] = {}
-
-                if item not in data[raid_instance][boss][name]:
-                    data[raid_instance][boss][name][item] = {'item_info': row.copy()}
-                    data[raid_instance][boss][name][item]['item_info']['Number reserved'] = 1
-                    data[raid_instance][boss][name][item]['item_info']['Date'] = [row['Date']]
-                    data[raid_instance][boss][name][item]['raid_dates'] = []
-
-                    if max_date_str:
-                        data[raid_instance][boss][name][item]['raid_dates'].append(max_date_str)
-                else:
-                    if 'Number reserved' in data[raid_instance][boss][name][item]['item_info']:
-                        data[raid_instance][boss][name][item]['item_info']['Number reserved'] += 1
-                    else:
-                        data[raid_instance][boss][name][item]['item_info']['Number reserved'] = 2
-
-                    if isinstance(data[raid_instance][boss][name][item]['item_info']['Date'], list):
-                        if row['Date'] not in data[raid_instance][boss][name][item]['item_info']['Date']:
-                            data[raid_instance][boss][name][item]['item_info']['Date'].append(row['Date'])
-                    else:
-                        if row['Date'] != data[raid_instance][boss][name][item]['item_info']['Date']:
-                            data[raid_instance][boss][name][item]['item_info']['Date'] = \
-                                [data[raid_instance][boss][name][item]['item_info']['Date'], row['Date']]
-
-                    if max_date_str:
-                        data[raid_instance][boss][name][item]['raid_dates'].append(max_date_str)
+        # Find the raid instance based on the boss
+        raid_instance = boss_index.get(boss)
 
-    except FileNotFoundError:
-        print(f"Error: CSV file not found at {softres_export}")
-    except Exception as e:
-        print(f"Error reading or processing CSV data: {e}")
-
-    # Convert raid_dates to YYYY-MM-DD format
-    for raid_instance in data:
-        for boss in data[raid_instance]:
-            for name in data[raid_instance][boss]:
-                for item in data[raid_instance][boss][name]:
-                    data[raid_instance][boss][name][item]['raid_dates'] = [
-                        datetime.strptime(date, "%Y-%m-%d %H:%M:%S").strftime("%Y-%m-%d") if ' ' in date else date
-                        for date in data[raid_instance][boss][name][item]['raid_dates']
-                    ]
+        if raid_instance is None:
+            raid_instance = match_rule(rules, 'bosses', boss) or match_rule(rules, 'items', item)
+
+        if raid_instance is None and not interactive:
+            log.warning(f"Boss '{boss}' not found in any raid instance, queued '{item}' for resolution.")
+            queued_rows.append((boss, item, name, row))
+            continue
+
+        if raid_instance is None:
+            # Use the dictionary to store prompted raid instances
+            if item in prompted_instances:
+                raid_instance = prompted_instances[item]
+            else:
+                # Prompt for raid instance
+                print(f"Warning: Boss '{boss}' not found in any raid instance.")
+                while raid_instance is None:
+                    if boss_data:
+                        print("Available raid instances:")
+                        for instance in boss_data.keys():
+                            print(f"- {instance}")
+                    raid_instance = input(f"Enter the correct raid instance for '{item}': ")
+                    if raid_instance not in boss_data:
+                        print("Invalid raid instance. Please try again.")
+                        raid_instance = None  # Reset to None for the loop
+                # Store the prompted instance
+                prompted_instances[item] = raid_instance
+
+        add_softres_row(data, raid_instance, boss, name, row, max_date_str, date_sets)
+
+    for boss, item, name, row in queued_rows:
+        queue_boss(pending, boss, item, {'name': name, 'row': row, 'raidWeek': max_date_str})
+
+    if stats is not None:
+        stats.update({'rows': rows, 'queued_rows': len(queued_rows)})
 
     return data
 
 
-def update_was_sr(raid_data, softres_data):
+def add_softres_row(data, raid_instance, boss, name, row, max_date_str, date_sets=None):
+    """
+    Adds a single soft reserve row to data under raid instance, boss and
+    character, counting repeat reservations of the same item.
+
+    Args:
+        data: The soft reserve data, updated in place.
+        raid_instance, boss, name: Where the row goes.
+        row: The CSV row without the 'Name' column.
+        max_date_str: The raid week to record, or None to leave it to the caller.
+        date_sets: Optional cache of the reservation dates as sets, keyed by
+                   (raid_instance, boss, name, item), to avoid list lookups.
+
+    Returns:
+        The entry ({'item_info', 'raid_dates'}) the row was added to.
+    """
+    items = data.setdefault(raid_instance, {}).setdefault(boss, {}).setdefault(name, {})
+
+    item = row['Item']
+    entry = items.get(item)
+    if entry is None:
+        entry = items[item] = {'item_info': row.copy()}
+        entry['item_info']['Number reserved'] = 1
+        entry['item_info']['Date'] = [row['Date']]
+        entry['raid_dates'] = []
+        if date_sets is not None:
+            date_sets[(raid_instance, boss, name, item)] = {row['Date']}
+    else:
+        item_info = entry['item_info']
+        item_info['Number reserved'] = item_info.get('Number reserved', 1) + 1
+
+        if not isinstance(item_info['Date'], list):
+            item_info['Date'] = [item_info['Date']]
+        if date_sets is None:
+            seen_dates = set(item_info['Date'])
+        else:
+            seen_dates = date_sets.setdefault((raid_instance, boss, name, item), set(item_info['Date']))
+        if row['Date'] not in seen_dates:
+            item_info['Date'].append(row['Date'])
+            seen_dates.add(row['Date'])
+
+    if max_date_str:
+        entry['raid_dates'].append(max_date_str)
+    return entry
+
+
+def merge_softres_entry(item_info, raid_dates, item_data):
+    """
+    Merges a newly decoded reservation entry into the item_info of an
+    existing entry that records raid_dates. The reservations of raid weeks
+    already recorded are not counted again.
+
+    Returns:
+        The raid weeks of item_data that are new to the entry (the caller
+        adds them to the entry), or None if item_data adds nothing.
+    """
+    known_weeks = set(raid_dates)
+    new_weeks = [week for week in item_data['raid_dates'] if week not in known_weeks]
+    if item_data['raid_dates'] and not new_weeks:
+        return None
+    item_info['Number reserved'] = (item_info.get('Number reserved', 1)
+                                    + item_data['item_info']['Number reserved']
+                                    - (len(item_data['raid_dates']) - len(new_weeks)))
+    if not isinstance(item_info['Date'], list):
+        item_info['Date'] = [item_info['Date']]
+    for date in item_data['item_info']['Date']:
+        if date not in item_info['Date']:
+            item_info['Date'].append(date)
+    return new_weeks
+
+
+def copy_for_merge(existing_softres_data, softres_data):
+    """
+    Returns a copy of existing_softres_data that merge_softres_data can
+    merge softres_data into without changing existing_softres_data. Only
+    the raid, boss and character levels softres_data touches and the item
+    entries it merges into are copied, the rest is shared.
+    """
+    result = dict(existing_softres_data)
+    for raid_instance, bosses in softres_data.items():
+        if raid_instance not in result:
+            continue
+        target_bosses = result[raid_instance] = dict(result[raid_instance])
+        for boss, characters in bosses.items():
+            if boss not in target_bosses:
+                continue
+            target_characters = target_bosses[boss] = dict(target_bosses[boss])
+            for name, items in characters.items():
+                if name not in target_characters:
+                    continue
+                target_items = target_characters[name] = dict(target_characters[name])
+                for item in items:
+                    if item in target_items:
+                        target_items[item] = copy.deepcopy(target_items[item])
+    return result
+
+
+def merge_softres_data(existing_softres_data, softres_data):
+    """
+    Merges newly decoded soft reserve data (e.g. one week) into
+    existing_softres_data. The result is the same as decoding that export
+    on top of the existing data. Reservations are keyed on their raid
+    week, like loot events on their id: those of a raid week an entry
+    already records are skipped, so merging the same export twice leaves
+    the data unchanged.
+    """
+    for raid_instance, bosses in softres_data.items():
+        for boss, characters in bosses.items():
+            for name, items in characters.items():
+                target = existing_softres_data.setdefault(raid_instance, {}).setdefault(boss, {}).setdefault(name, {})
+                for item, item_data in items.items():
+                    if item not in target:
+                        target[item] = item_data
+                        continue
+                    new_weeks = merge_softres_entry(target[item]['item_info'], target[item]['raid_dates'], item_data)
+                    if new_weeks is not None:
+                        target[item]['raid_dates'].extend(new_weeks)
+    return existing_softres_data
+
+
+def build_sr_index(softres_data):
+    """
+    Builds a lookup of soft reserves keyed by (character, ItemId), mapping to
+    the set of raid dates on which the character reserved that item.
+
+    Args:
+        softres_data: The dictionary containing soft reserve data.
+
+    Returns:
+        A dictionary of {(character, item_id): set of raid dates}.
+    """
+    sr_index = {}
+    for bosses in softres_data.values():
+        for softres_items in bosses.values():
+            for character, items in softres_items.items():
+                for softres_item_data in items.values():
+                    item_id = softres_item_data['item_info']['ItemId']
+                    sr_index.setdefault((character, item_id), set()).update(softres_item_data['raid_dates'])
+    return sr_index
+
+
+def update_was_sr(raid_data, softres_data, characters=None):
     """
     Updates the raid_data with a new key 'wasSr' to indicate if an item was also soft reserved
-    by the same person on the same date.
+    by the same person on the same date. Events already flagged as soft reserved are left
+    untouched, so only new or previously unmatched events are re-checked.
 
     Args:
         raid_data: The dictionary containing raid data.
         softres_data: The dictionary containing soft reserve data.
+        characters: Optional set of characters to limit the pass to.
 
     Returns:
         The updated raid_data with the 'wasSr' key added.
     """
+    sr_index = build_sr_index(softres_data)
+    checked = 0
+    flagged = 0
+
     for character, specs in raid_data.items():
-        print(f"Processing character: {character}")
+        if characters is not None and character not in characters:
+            continue
         for spec, items in specs.items():
             for item_id, item_data in items.items():
+                softres_dates = sr_index.get((character, item_id))
                 for event in item_data['lootEvents']:
-                    raid_week = event['raidWeek']
-                    was_sr = event.get('wasSr', False)  # Preserve existing wasSr value if True
-
-                    # Check if the item was soft reserved by the same character on the same date
-                    for raid_instance, bosses in softres_data.items():
-                        for boss, softres_items in bosses.items():
-                            if character in softres_items:
-                                print(f"Character {character} found in softres_data under boss {boss}")
-                                for softres_item, softres_item_data in softres_items[character].items():
-                                    if item_id == softres_item_data['item_info']['ItemId']:
-                                        print(f"Item {item_id} found for character {character} in softres_data")
-                                        softres_dates = softres_item_data['raid_dates']
-                                        print(f"Comparing raid_week {raid_week} with softres_dates {softres_dates}")
-                                        if any(date in raid_week for date in softres_dates):
-                                            was_sr = True
-                                            break
-                                else:
-                                    print(f"Item {item_id} not found for character {character} in softres_data under boss {boss}")
-                            else:
-                                print(f"Character {character} not found in softres_data under boss {boss}")
-                            if was_sr:
-                                break
-                        if was_sr:
-                            break
+                    if event.get('wasSr'):
+                        continue
 
+                    checked += 1
+                    was_sr = bool(softres_dates) and any(date in softres_dates for date in event['raidWeek'])
                     event['wasSr'] = was_sr
+                    if was_sr:
+                        flagged += 1
 
-                    if not was_sr:
-                        print(f"Warning: {character} not found in soft reserve data or no matching dates for item {item_id}")
+    log.info(f"wasSr: checked {checked} loot events, {flagged} newly matched to a soft reserve")
 
-    return raid_data
\ No newline at end of file
+    return raid_data
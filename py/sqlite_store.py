@@ -0,0 +1,280 @@
+import json
+import logging
+import os
+import sqlite3
+
+from model import ITEM_LINK
+from softres_converter import merge_softres_entry
+
+base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+db_file = os.path.join(base_dir, 'data', 'loot_history.db')
+
+log = logging.getLogger(__name__)
+
+# Bumped when a table changes; an older database is dropped and refilled from the JSON files
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS characters (
+    name TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS items (
+    item_id TEXT PRIMARY KEY,
+    item_name TEXT,
+    raid TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_items_raid ON items(raid);
+
+CREATE TABLE IF NOT EXISTS loot_events (
+    id INTEGER PRIMARY KEY,
+    character TEXT NOT NULL REFERENCES characters(name),
+    spec TEXT NOT NULL,
+    item_id TEXT NOT NULL REFERENCES items(item_id),
+    event_id TEXT NOT NULL,
+    was_sr INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (character, spec, item_id, event_id)
+);
+CREATE INDEX IF NOT EXISTS idx_loot_item ON loot_events(item_id);
+
+-- One row per loot occurrence; an event looted more than once has several seq rows
+CREATE TABLE IF NOT EXISTS loot_times (
+    event INTEGER NOT NULL REFERENCES loot_events(id),
+    seq INTEGER NOT NULL,
+    date_time TEXT NOT NULL,
+    raid_week TEXT,
+    PRIMARY KEY (event, seq)
+);
+CREATE INDEX IF NOT EXISTS idx_loot_week ON loot_times(raid_week);
+CREATE INDEX IF NOT EXISTS idx_loot_date ON loot_times(date_time);
+
+CREATE TABLE IF NOT EXISTS soft_reserves (
+    id INTEGER PRIMARY KEY,
+    raid TEXT NOT NULL,
+    boss TEXT NOT NULL,
+    character TEXT NOT NULL REFERENCES characters(name),
+    item TEXT NOT NULL,
+    item_id TEXT,
+    item_info TEXT NOT NULL,
+    UNIQUE (raid, boss, character, item)
+);
+CREATE INDEX IF NOT EXISTS idx_sr_character_item ON soft_reserves(character, item_id);
+CREATE INDEX IF NOT EXISTS idx_sr_item ON soft_reserves(item_id);
+
+CREATE TABLE IF NOT EXISTS soft_reserve_weeks (
+    sr_id INTEGER NOT NULL REFERENCES soft_reserves(id),
+    seq INTEGER NOT NULL,
+    raid_week TEXT NOT NULL,
+    PRIMARY KEY (sr_id, seq)
+);
+CREATE INDEX IF NOT EXISTS idx_sr_week ON soft_reserve_weeks(raid_week);
+"""
+
+
+class LootStore:
+    """
+    SQLite storage for loot events and soft reserves. raid_data.json and
+    softres_data.json become export views of the database (export_raid_data
+    and export_softres_data). New imports are merged with bulk upserts
+    instead of rewriting the whole history.
+    """
+
+    def __init__(self, path=db_file):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            self._drop_tables()
+        self.conn.executescript(SCHEMA)
+
+    def _drop_tables(self):
+        tables = [name for name, in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        if tables:
+            log.info(f"SQLite: dropping the tables of an older schema from {os.path.basename(self.path)}")
+        with self.conn:
+            for table in tables:
+                self.conn.execute(f"DROP TABLE {table}")
+            self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def close(self):
+        self.conn.close()
+
+    def is_empty(self):
+        return self.conn.execute("SELECT NOT EXISTS (SELECT 1 FROM loot_events)"
+                                 " AND NOT EXISTS (SELECT 1 FROM soft_reserves)").fetchone()[0] == 1
+
+    def _upsert_loot(self, raid_data):
+        events = {}
+        for character, specs in raid_data.items():
+            for spec, items in specs.items():
+                for item_id, item_data in items.items():
+                    for event in item_data['lootEvents']:
+                        events.setdefault((character, spec, item_id, event['id']), event)
+
+        self.conn.executemany("INSERT OR IGNORE INTO characters (name) VALUES (?)", ((name,) for name in raid_data))
+        self.conn.executemany("INSERT OR IGNORE INTO items (item_id, item_name, raid) VALUES (?, ?, ?)",
+                              ((item_id, item_data['itemName'], item_data['raid'])
+                               for specs in raid_data.values() for items in specs.values()
+                               for item_id, item_data in items.items()))
+        # Same rule as merge_raid_data: an event id that is already stored is skipped whole
+        last_id = self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM loot_events").fetchone()[0]
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO loot_events (character, spec, item_id, event_id, was_sr) VALUES (?, ?, ?, ?, ?)",
+            (key + (int(bool(event.get('wasSr'))),) for key, event in events.items()))
+
+        affected = set()
+        times = []
+        for row_id, *key in self.conn.execute(
+                "SELECT id, character, spec, item_id, event_id FROM loot_events WHERE id > ? ORDER BY id", (last_id,)):
+            event = events[tuple(key)]
+            raid_weeks = event.get('raidWeek') or []
+            times.extend((row_id, seq, date_time, raid_weeks[seq] if seq < len(raid_weeks) else None)
+                         for seq, date_time in enumerate(event['dateTime']))
+            affected.add(key[0])
+        self.conn.executemany("INSERT INTO loot_times (event, seq, date_time, raid_week) VALUES (?, ?, ?, ?)", times)
+        return affected
+
+    def _upsert_softres(self, softres_data):
+        for raid_instance, bosses in softres_data.items():
+            for boss, characters in bosses.items():
+                for name, items in characters.items():
+                    self.conn.execute("INSERT OR IGNORE INTO characters (name) VALUES (?)", (name,))
+                    for item, item_data in items.items():
+                        row = self.conn.execute(
+                            "SELECT id, item_info FROM soft_reserves WHERE raid = ? AND boss = ? AND character = ? AND item = ?",
+                            (raid_instance, boss, name, item)).fetchone()
+                        if row is None:
+                            cursor = self.conn.execute(
+                                "INSERT INTO soft_reserves (raid, boss, character, item, item_id, item_info)"
+                                " VALUES (?, ?, ?, ?, ?, ?)",
+                                (raid_instance, boss, name, item, item_data['item_info'].get('ItemId'),
+                                 json.dumps(item_data['item_info'], ensure_ascii=False)))
+                            sr_id, first_seq, raid_dates = cursor.lastrowid, 0, item_data['raid_dates']
+                        else:
+                            sr_id, item_info = row[0], json.loads(row[1])
+                            known_weeks = [week for week, in self.conn.execute(
+                                "SELECT raid_week FROM soft_reserve_weeks WHERE sr_id = ?", (sr_id,))]
+                            raid_dates = merge_softres_entry(item_info, known_weeks, item_data)
+                            if raid_dates is None:
+                                continue
+                            self.conn.execute("UPDATE soft_reserves SET item_info = ? WHERE id = ?",
+                                              (json.dumps(item_info, ensure_ascii=False), sr_id))
+                            first_seq = self.conn.execute(
+                                "SELECT COALESCE(MAX(seq) + 1, 0) FROM soft_reserve_weeks WHERE sr_id = ?",
+                                (sr_id,)).fetchone()[0]
+                        self.conn.executemany(
+                            "INSERT INTO soft_reserve_weeks (sr_id, seq, raid_week) VALUES (?, ?, ?)",
+                            [(sr_id, first_seq + seq, raid_week) for seq, raid_week in enumerate(raid_dates)])
+
+    def _update_was_sr(self):
+        # An event counts as soft reserved if any of its raid weeks matches a
+        # raid week in which the same character reserved the same item ID
+        return self.conn.execute("""
+            UPDATE loot_events SET was_sr = 1
+            WHERE was_sr = 0 AND EXISTS (
+                SELECT 1 FROM loot_times AS t
+                JOIN soft_reserves AS s ON s.character = loot_events.character AND s.item_id = loot_events.item_id
+                JOIN soft_reserve_weeks AS w ON w.sr_id = s.id AND w.raid_week = t.raid_week
+                WHERE t.event = loot_events.id
+            )""").rowcount
+
+    def ingest(self, raid_data=None, softres_data=None):
+        """
+        Merges newly converted loot and soft reserve data in a single
+        transaction and refreshes the wasSr flags.
+
+        Args:
+            raid_data: Raid data converted from the new loot import.
+            softres_data: Soft reserve data decoded from the new SR import
+                          only (not merged with the stored data).
+
+        Returns:
+            The set of characters that received new loot events.
+        """
+        with self.conn:
+            if softres_data:
+                self._upsert_softres(softres_data)
+            affected = self._upsert_loot(raid_data) if raid_data else set()
+            flagged = self._update_was_sr()
+        log.info(f"SQLite: stored new loot for {len(affected)} characters, {flagged} loot events matched to a soft reserve")
+        return affected
+
+    def replace_all(self, raid_data, softres_data):
+        """
+        Replaces the whole database with the given documents, e.g. after a
+        rebuild or when migrating existing JSON files.
+        """
+        with self.conn:
+            for table in ('loot_times', 'loot_events', 'soft_reserve_weeks', 'soft_reserves', 'items', 'characters'):
+                self.conn.execute(f"DELETE FROM {table}")
+            self._upsert_softres(softres_data)
+            self._upsert_loot(raid_data)
+
+    def export_raid_data(self):
+        """
+        Rebuilds the raid_data.json document from the database.
+        """
+        raid_data = {}
+        events = {}
+        rows = self.conn.execute("""
+            SELECT l.character, l.spec, l.item_id, i.item_name, i.raid, l.event_id, t.date_time, t.raid_week, l.was_sr
+            FROM loot_times AS t JOIN loot_events AS l ON l.id = t.event JOIN items AS i ON i.item_id = l.item_id
+            ORDER BY l.id, t.seq""")
+        for character, spec, item_id, item_name, raid, event_id, date_time, raid_week, was_sr in rows:
+            items = raid_data.setdefault(character, {"Mainspec": {}, "Offspec": {}}).setdefault(spec, {})
+            if item_id not in items:
+                items[item_id] = {
+                    "itemName": item_name,
+                    "itemLink": ITEM_LINK.format(item_id),
+                    "raid": raid,
+                    "lootEvents": []
+                }
+            key = (character, spec, item_id, event_id)
+            event = events.get(key)
+            if event is None:
+                event = events[key] = {"dateTime": [], "timesLooted": 0, "id": event_id, "raidWeek": [], "wasSr": False}
+                items[item_id]["lootEvents"].append(event)
+            event["dateTime"].append(date_time)
+            event["timesLooted"] += 1
+            event["raidWeek"].append(raid_week)
+            event["wasSr"] = event["wasSr"] or bool(was_sr)
+        return raid_data
+
+    def export_softres_data(self):
+        """
+        Rebuilds the softres_data.json document from the database.
+        """
+        raid_dates = {}
+        for sr_id, raid_week in self.conn.execute("SELECT sr_id, raid_week FROM soft_reserve_weeks ORDER BY sr_id, seq"):
+            raid_dates.setdefault(sr_id, []).append(raid_week)
+
+        softres_data = {}
+        rows = self.conn.execute("SELECT id, raid, boss, character, item, item_info FROM soft_reserves ORDER BY id")
+        for sr_id, raid_instance, boss, name, item, item_info in rows:
+            softres_data.setdefault(raid_instance, {}).setdefault(boss, {}).setdefault(name, {})[item] = {
+                'item_info': json.loads(item_info),
+                'raid_dates': raid_dates.get(sr_id, []),
+            }
+        return softres_data
+
+    def who_received(self, item):
+        """
+        Lists every loot of an item, given its ID or (part of) its name.
+        """
+        return self.conn.execute("""
+            SELECT l.character, l.spec, i.item_name, t.date_time, l.was_sr
+            FROM loot_times AS t JOIN loot_events AS l ON l.id = t.event JOIN items AS i ON i.item_id = l.item_id
+            WHERE l.item_id = ? OR i.item_name LIKE ?
+            ORDER BY t.date_time, l.character""", (item, f"%{item}%")).fetchall()
+
+    def loot_since(self, date, character=None):
+        """
+        Lists loot on or after date, optionally for one character only.
+        """
+        query = """
+            SELECT l.character, l.spec, i.item_name, i.raid, t.date_time, l.was_sr
+            FROM loot_times AS t JOIN loot_events AS l ON l.id = t.event JOIN items AS i ON i.item_id = l.item_id
+            WHERE t.date_time >= ?"""
+        params = [date]
+        if character:
+            query += " AND l.character = ?"
+            params.append(character)
+        return self.conn.execute(query + " ORDER BY l.character, t.date_time", params).fetchall()
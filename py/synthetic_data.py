@@ -0,0 +1,151 @@
+import argparse
+import csv
+import json
+import os
+import random
+from datetime import date, timedelta
+
+base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+lookup_dir = os.path.join(base_dir, 'data', 'lookup_tables')
+boss_dict = os.path.join(lookup_dir, 'bosses_per_raid.json')
+
+SYLLABLES = ['ka', 'ro', 'thu', 'mir', 'del', 'van', 'gor', 'li', 'zan', 'bel', 'tor', 'nå', 'qui', 'sha', 'dra', 'mé']
+SR_HEADER = ['Item', 'ItemId', 'From', 'Name', 'Class', 'Spec', 'Note', 'Plus', 'Date']
+CLASS_SPECS = {
+    'Warrior': ['Fury', 'Protection'],
+    'Rogue': ['Combat'],
+    'Mage': ['Frost', 'Fire'],
+    'Warlock': ['Destruction'],
+    'Hunter': ['Marksmanship'],
+    'Priest': ['Holy', 'Shadow'],
+    'Druid': ['Restoration', 'Feral'],
+    'Shaman': ['Enhancement', 'Restoration'],
+}
+
+
+def make_roster(rng, size):
+    """
+    Returns size unique, capitalised character names, a few with accents
+    like the real roster.
+    """
+    names = []
+    seen = set()
+    while len(names) < size:
+        name = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3))).capitalize()
+        if name not in seen:
+            seen.add(name)
+            names.append(name)
+    return names
+
+
+def load_raid_items(raids):
+    """
+    Returns {raid: ([(item_id, item_name)], [boss names])} for the raids that
+    have both a loot table and a boss list.
+    """
+    with open(boss_dict, 'r', encoding='utf-8') as f:
+        bosses = json.load(f)
+    raid_items = {}
+    for raid in raids:
+        path = os.path.join(lookup_dir, f"{raid}_loot_table.json")
+        if raid not in bosses or not os.path.exists(path):
+            raise ValueError(f"No loot table or boss list for raid {raid}")
+        with open(path, 'r', encoding='utf-8') as f:
+            items = sorted(json.load(f).items())
+        raid_items[raid] = (items, bosses[raid]['boss_names'])
+    return raid_items
+
+
+def generate_exports(out_dir, roster_size=40, weeks=12, items_per_week=60, raids=('Naxx', 'AQ'),
+                     sr_per_character=2, sr_win_rate=0.4, offspec_rate=0.15, unknown_item_rate=0.0,
+                     start=date(2025, 1, 5), seed=1):
+    """
+    Writes synthetic weekly exports in the backup layout: out_dir/Loot/<week>
+    (loot export CSV) and out_dir/SR/<week> (Gargul SR CSV), plus
+    out_dir/roster.txt. Items come from the real loot tables, weeks rotate
+    through raids, and a share of the loot goes to a character who soft
+    reserved it, so the wasSr matching has work to do. The same arguments
+    always produce the same files.
+
+    Args:
+        out_dir: Where to write the exports.
+        roster_size: Number of characters.
+        weeks: Number of weekly raids.
+        items_per_week: Loot rows per week.
+        raids: Raids to rotate through, each needs a loot table and bosses.
+        sr_per_character: Soft reserves per character per week.
+        sr_win_rate: Share of loot rows that go to a character who reserved the item.
+        offspec_rate: Share of loot rows marked as offspec.
+        unknown_item_rate: Share of loot rows with item IDs missing from the
+                           lookup tables, to exercise the API path.
+        start: Date of the first raid.
+        seed: Random seed.
+
+    Returns:
+        A list of the generated week names.
+    """
+    rng = random.Random(seed)
+    roster = make_roster(rng, roster_size)
+    classes = {name: rng.choice(sorted(CLASS_SPECS)) for name in roster}
+    raid_items = load_raid_items(raids)
+
+    os.makedirs(os.path.join(out_dir, 'Loot'), exist_ok=True)
+    os.makedirs(os.path.join(out_dir, 'SR'), exist_ok=True)
+    with open(os.path.join(out_dir, 'roster.txt'), 'w', encoding='utf-8') as f:
+        f.write(',\n'.join(roster + ['_disenchanted']))
+
+    week_names = []
+    for week in range(weeks):
+        raid_day = start + timedelta(days=7 * week)
+        week_name = raid_day.isoformat()
+        week_names.append(week_name)
+        items, bosses = raid_items[raids[week % len(raids)]]
+
+        reservations = []
+        for name in roster:
+            for item_id, item_name in rng.sample(items, min(sr_per_character, len(items))):
+                reservations.append((name, item_id, item_name))
+
+        with open(os.path.join(out_dir, 'SR', week_name), 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f, quoting=csv.QUOTE_MINIMAL)
+            writer.writerow(SR_HEADER)
+            for name, item_id, item_name in reservations:
+                reserved_at = f"{week_name} {rng.randint(17, 20):02d}:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}"
+                writer.writerow([item_name, item_id, rng.choice(bosses), name, classes[name],
+                                 rng.choice(CLASS_SPECS[classes[name]]), '', 0, reserved_at])
+
+        with open(os.path.join(out_dir, 'Loot', week_name), 'w', encoding='utf-8', newline='') as f:
+            f.write('dateTime,character,itemID,offspec,id\n')
+            for _ in range(items_per_week):
+                if rng.random() < sr_win_rate:
+                    character, item_id, _ = rng.choice(reservations)
+                else:
+                    character = rng.choice(roster)
+                    item_id = rng.choice(items)[0]
+                if rng.random() < unknown_item_rate:
+                    item_id = str(900000 + rng.randint(0, 999))
+                offspec = 1 if rng.random() < offspec_rate else 0
+                f.write(f"{week_name},{character},{item_id},{offspec},{rng.randint(10 ** 19, 10 ** 20 - 1)}\n")
+
+    return week_names
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic loot and soft reserve exports.")
+    parser.add_argument('out_dir')
+    parser.add_argument('--roster', type=int, default=40, help="Number of characters")
+    parser.add_argument('--weeks', type=int, default=12, help="Number of weeks")
+    parser.add_argument('--items', type=int, default=60, help="Loot rows per week")
+    parser.add_argument('--raids', default='Naxx,AQ', help="Comma separated raids to rotate through")
+    parser.add_argument('--unknown-items', type=float, default=0.0,
+                        help="Share of loot rows with items missing from the lookup tables")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    weeks = generate_exports(args.out_dir, args.roster, args.weeks, args.items, tuple(args.raids.split(',')),
+                             unknown_item_rate=args.unknown_items, seed=args.seed)
+    print(f"Wrote {len(weeks)} weeks of exports for {args.roster} characters to {args.out_dir}")
+
+
+if __name__ == '__main__':
+    main()
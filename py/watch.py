@@ -0,0 +1,74 @@
+import logging
+import os
+import time
+
+from run_report import RunReport, report_file
+
+log = logging.getLogger(__name__)
+
+
+def file_signature(path):
+    """
+    Returns (mtime, size) of path, or None if it does not exist.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def watch(pipeline, loot_export, softres_export, interval=2.0, settle=1.0, on_publish=None,
+          report_path=report_file, max_polls=None):
+    """
+    Keeps the pipeline resident and ingests the import files whenever one
+    of them changes. The files are polled rather than watched with OS
+    events, so nothing beyond the standard library is needed. A change is
+    only ingested once the file has stopped changing for settle seconds,
+    so a half-copied export is never read. Files the ledger already lists
+    are skipped by the pipeline, so dropping in the loot export and the
+    soft reserve export at different times ingests each one once.
+
+    Args:
+        pipeline: The Pipeline to ingest with, it should not be interactive.
+        loot_export: The loot import file to watch.
+        softres_export: The soft reserve import file to watch.
+        interval: Seconds between polls.
+        settle: Seconds a changed file has to stay unchanged.
+        on_publish: Called after every ingest that published new data,
+            e.g. to upload the site.
+        report_path: Where the run report of the last ingest is written.
+        max_polls: Stop after this many polls (None watches until interrupted).
+    """
+    paths = (loot_export, softres_export)
+    # Anything that is not ingested yet is picked up right away
+    seen = None
+    polls = 0
+    log.info(f"Watching {os.path.dirname(loot_export)} every {interval}s, press Ctrl+C to stop")
+    try:
+        while max_polls is None or polls < max_polls:
+            polls += 1
+            current = tuple(file_signature(path) for path in paths)
+            if current != seen:
+                time.sleep(settle)
+                if tuple(file_signature(path) for path in paths) != current:
+                    continue  # Still being written, check again on the next poll
+                seen = current
+                report = RunReport('watch')
+                try:
+                    ingested = pipeline.ingest(loot_export, softres_export, report=report)
+                except Exception:
+                    log.exception("Ingest failed, waiting for the next change")
+                    continue
+                if ingested:
+                    report.write(report_path)
+                    if on_publish:
+                        try:
+                            on_publish()
+                        except Exception:
+                            log.exception("Publishing failed, it is retried after the next ingest")
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        log.info("Stopped watching")
+    finally:
+        pipeline.close()
@@ -1,22 +1,18 @@
-fetch("data/raid_data.json")
+fetch("data/shards/manifest.json")
   .then((response) => response.json())
-  .then((raidData) => {
+  .then((manifest) => {
     const lootDataDiv = document.getElementById("loot-data");
 
-    // Get all unique raid names
-    const raids = new Set();
-    for (const character in raidData) {
-      for (const itemId in raidData[character].Mainspec) {
-        raids.add(raidData[character].Mainspec[itemId].raid);
-      }
-      for (const itemId in raidData[character].Offspec) {
-        raids.add(raidData[character].Offspec[itemId].raid);
-      }
-    }
-    const sortedRaids = Array.from(raids).sort();
+    // Raid names and their characters come from the manifest, the loot itself
+    // is only downloaded when a raid accordion is first opened
+    const sortedRaids = Object.keys(manifest.raids).sort();
 
     sortedRaids.forEach((raid) => {
-      const { accordionDiv, cardBody: raidCardBody } = createAccordion(
+      const {
+        accordionDiv,
+        cardBody: raidCardBody,
+        collapseDiv: raidCollapseDiv,
+      } = createAccordion(
         `accordion-${raid}`,
         `heading-${raid}`,
         raid,
@@ -24,50 +20,50 @@ fetch("data/raid_data.json")
       );
       lootDataDiv.appendChild(accordionDiv);
 
-      // Find characters who have loot for this raid
-      const charactersInRaid = Object.keys(raidData)
-        .filter((character) => {
-          const mainspecLoot = raidData[character].Mainspec
-            ? Object.values(raidData[character].Mainspec)
-            : [];
-          const offspecLoot = raidData[character].Offspec
-            ? Object.values(raidData[character].Offspec)
-            : [];
-          return mainspecLoot
-            .concat(offspecLoot)
-            .some((item) => item.raid === raid);
-        })
-        .sort();
-
-      charactersInRaid.forEach((character) => {
-        const {
-          accordionDiv: characterAccordionDiv,
-          cardBody: characterCardBody,
-        } = createAccordion(
-          `accordion-${character}`,
-          `heading-${character}`,
-          character,
-          `accordion-${character}`
-        );
-        raidCardBody.appendChild(characterAccordionDiv);
-
-        processLoot(raidData[character], "Mainspec", characterCardBody, raid); // Pass raid to processLoot
-        processLoot(raidData[character], "Offspec", characterCardBody, raid); // Pass raid to processLoot
-      });
+      raidCollapseDiv.addEventListener(
+        "show.bs.collapse",
+        () => {
+          fetch(`data/${manifest.raids[raid].file}`)
+            .then((response) => response.json())
+            .then((raidShard) => {
+              // Characters who have loot for this raid
+              const charactersInRaid = manifest.raids[raid].characters;
+
+              charactersInRaid.forEach((character) => {
+                const {
+                  accordionDiv: characterAccordionDiv,
+                  cardBody: characterCardBody,
+                } = createAccordion(
+                  `accordion-${character}`,
+                  `heading-${character}`,
+                  character,
+                  `accordion-${character}`
+                );
+                raidCardBody.appendChild(characterAccordionDiv);
+
+                processLoot(raidShard[character], "Mainspec", characterCardBody, raid); // Pass raid to processLoot
+                processLoot(raidShard[character], "Offspec", characterCardBody, raid); // Pass raid to processLoot
+              });
+            })
+            .catch((error) => {
+              console.error(`Error fetching loot for ${raid}:`, error);
+            });
+        },
+        { once: true }
+      );
     });
+  })
+  .catch((error) => {
+    console.error("Error fetching or processing data:", error);
+  });
 
-    const allDates = [];
-    for (const character in raidData) {
-      const characterData = raidData[character];
-      const mainspecDates = Object.values(characterData.Mainspec)
-        .flatMap((item) => item.lootEvents)
-        .flatMap((event) => event.dateTime);
-      const offspecDates = Object.values(characterData.Offspec)
-        .flatMap((item) => item.lootEvents)
-        .flatMap((event) => event.dateTime);
-      allDates.push(...mainspecDates, ...offspecDates);
-    }
-    const latestDate = allDates.sort().pop();
+fetch("data/summary.min.json")
+  .then((response) => response.json())
+  .then((summary) => {
+    const lootDataDiv = document.getElementById("loot-data");
+
+    // Counts, item lists and the latest loot date are precomputed by the Python pipeline
+    const latestDate = summary.latestDate;
 
     const { accordionDiv: latestAccordionDiv, cardBody: latestCardBody } =
       createAccordion(
@@ -90,57 +86,16 @@ fetch("data/raid_data.json")
     ]);
     tableBody.appendChild(latestLootHeaderRow);
 
-    const characterLoot = {};
-    for (const character in raidData) {
-      const characterData = raidData[character];
-      characterLoot[character] = [];
-
-      const mainspecItems = (
-        characterData.Mainspec && Object.keys(characterData.Mainspec).length > 0
-          ? Object.values(characterData.Mainspec)
-          : []
-      )
-        .filter((item) =>
-          item.lootEvents.some((event) => event.dateTime.includes(latestDate))
-        )
-        .map((item) => ({
-          itemName: item.itemName,
-          itemLink: item.itemLink,
-          wasSr: item.lootEvents.some((event) => event.wasSr),
-        }));
-
-      const offspecItems = (
-        characterData.Offspec && Object.keys(characterData.Offspec).length > 0
-          ? Object.values(characterData.Offspec)
-          : []
-      )
-        .filter((item) =>
-          item.lootEvents.some((event) => event.dateTime.includes(latestDate))
-        )
-        .map((item) => ({
-          itemName: item.itemName,
-          itemLink: item.itemLink,
-          wasSr: item.lootEvents.some((event) => event.wasSr),
-        }));
-
-      characterLoot[character] = mainspecItems.concat(offspecItems);
-    }
-
-    // Sort characterLoot alphabetically by character name
-    const sortedCharacterLoot = Object.keys(characterLoot)
-      .sort()
-      .reduce((acc, key) => {
-        acc[key] = characterLoot[key];
-        return acc;
-      }, {});
+    // Characters are already sorted alphabetically
+    const characterLoot = summary.latest;
 
     // Determine the maximum number of items any character has
     const maxItems = Math.max(
       ...Object.values(characterLoot).map((items) => items.length)
     );
 
-    for (const character in sortedCharacterLoot) {
-      const items = sortedCharacterLoot[character].map((item) => {
+    for (const character in characterLoot) {
+      const items = characterLoot[character].map((item) => {
         const itemCell = createElement(
           "td",
           null,
@@ -189,60 +144,8 @@ fetch("data/raid_data.json")
     ]);
     totalTableBody.appendChild(totalLootHeaderRow);
 
-    const totalCharacterLoot = {};
-    const cutoffDate = new Date("2024-12-07"); // Set the cutoff date
-
-    for (const character in raidData) {
-      const characterData = raidData[character];
-      totalCharacterLoot[character] = {
-        mainspec: 0,
-        desecratedMainspec: 0,
-        offspec: 0,
-        desecratedOffspec: 0,
-      };
-
-      // Mainspec loot
-      if (characterData.Mainspec) {
-        for (const itemId in characterData.Mainspec) {
-          const item = characterData.Mainspec[itemId];
-
-          // Filter and aggregate lootEvents by date
-          item.lootEvents.forEach((event) => {
-            const lootDate = new Date(event.dateTime[0]);
-            if (lootDate >= cutoffDate) {
-              totalCharacterLoot[character].mainspec += event.timesLooted;
-
-              // Count Desecrated items separately
-              if (item.itemName.startsWith("Desecrated")) {
-                totalCharacterLoot[character].desecratedMainspec +=
-                  event.timesLooted;
-              }
-            }
-          });
-        }
-      }
-
-      // Offspec loot
-      if (characterData.Offspec) {
-        for (const itemId in characterData.Offspec) {
-          const item = characterData.Offspec[itemId];
-
-          // Filter and aggregate lootEvents by date
-          item.lootEvents.forEach((event) => {
-            const lootDate = new Date(event.dateTime[0]);
-            if (lootDate >= cutoffDate) {
-              totalCharacterLoot[character].offspec += event.timesLooted;
-
-              // Count Desecrated items separately
-              if (item.itemName.startsWith("Desecrated")) {
-                totalCharacterLoot[character].desecratedOffspec +=
-                  event.timesLooted;
-              }
-            }
-          });
-        }
-      }
-    }
+    // Totals since summary.phaseStart
+    const totalCharacterLoot = summary.totals;
 
     const sortedTotalCharacters = Object.keys(totalCharacterLoot).sort();
     sortedTotalCharacters.forEach((character) => {
@@ -258,11 +161,7 @@ fetch("data/raid_data.json")
       mainspecNumberSpan.style.pointerEvents = "none";
       mainspecCell.appendChild(mainspecNumberSpan);
 
-      const mainspecItems = [];
-      for (const itemId in raidData[character].Mainspec) {
-        const itemName = raidData[character].Mainspec[itemId].itemName;
-        mainspecItems.push(itemName);
-      }
+      const mainspecItems = totalCharacterLoot[character].mainspecItems;
       mainspecCell.dataset.tooltip = mainspecItems.join("\n");
       characterRow.appendChild(mainspecCell);
 
@@ -294,11 +193,7 @@ fetch("data/raid_data.json")
       offspecNumberSpan.style.pointerEvents = "none";
       offspecCell.appendChild(offspecNumberSpan);
 
-      const offspecItems = [];
-      for (const itemId in raidData[character].Offspec) {
-        const itemName = raidData[character].Offspec[itemId].itemName;
-        offspecItems.push(itemName);
-      }
+      const offspecItems = totalCharacterLoot[character].offspecItems;
       offspecCell.dataset.tooltip = offspecItems.join("\n");
       characterRow.appendChild(offspecCell);
 
@@ -335,7 +230,7 @@ fetch("data/raid_data.json")
     console.error("Error fetching or processing data:", error);
   });
 
-fetch("data/softres_data.json")
+fetch("data/softres_data.min.json")
   .then((response) => response.json())
   .then((srData) => {
     const {
@@ -440,6 +335,87 @@ fetch("data/softres_data.json")
     console.error("Error fetching or processing data:", error);
   });
 
+// Closed phases are archived with their own summary, which is only
+// downloaded when the phase is opened
+fetch("data/archive/manifest.json")
+  .then((response) => (response.ok ? response.json() : { phases: {} }))
+  .then((archive) => {
+    const phaseIds = Object.keys(archive.phases).sort().reverse();
+    if (phaseIds.length === 0) {
+      return;
+    }
+
+    const archiveDiv = document.getElementById("archive");
+    const archiveHeading = document.createElement("h2");
+    archiveHeading.textContent = "Previous Phases";
+    archiveDiv.appendChild(archiveHeading);
+
+    phaseIds.forEach((phaseId) => {
+      const phase = archive.phases[phaseId];
+      const period = phase.start
+        ? `${phase.start} to ${phase.end}`
+        : `until ${phase.end}`;
+      const {
+        accordionDiv: phaseAccordionDiv,
+        cardBody: phaseCardBody,
+        collapseDiv: phaseCollapseDiv,
+      } = createAccordion(
+        `accordion-phase-${phaseId}`,
+        `heading-phase-${phaseId}`,
+        `${phase.name} (${period})`,
+        `accordion-phase-${phaseId}`
+      );
+      archiveDiv.appendChild(phaseAccordionDiv);
+
+      phaseCollapseDiv.addEventListener(
+        "show.bs.collapse",
+        () => {
+          fetch(`data/${phase.summary.file}`)
+            .then((response) => response.json())
+            .then((summary) => {
+              const phaseTable = createTable(["table", "table-dark", "total"]);
+              const phaseTableBody = document.createElement("tbody");
+              phaseTable.appendChild(phaseTableBody);
+              phaseTableBody.appendChild(
+                createTableRow([
+                  createElement("th", "Name"),
+                  createElement("th", "Mainspec"),
+                  createElement("th", "Offspec"),
+                ])
+              );
+              makeTableSortable(phaseTable);
+
+              Object.keys(summary.totals)
+                .sort()
+                .forEach((character) => {
+                  const totals = summary.totals[character];
+                  const mainspecCell = createElement("td", `${totals.mainspec}`);
+                  mainspecCell.dataset.tooltip = totals.mainspecItems.join("\n");
+                  const offspecCell = createElement("td", `${totals.offspec}`);
+                  offspecCell.dataset.tooltip = totals.offspecItems.join("\n");
+                  phaseTableBody.appendChild(
+                    createTableRow([
+                      createElement("td", character),
+                      mainspecCell,
+                      offspecCell,
+                    ])
+                  );
+                });
+
+              phaseCardBody.appendChild(phaseTable);
+            })
+            .catch((error) => {
+              console.error(`Error fetching the archive of ${phaseId}:`, error);
+            });
+        },
+        { once: true }
+      );
+    });
+  })
+  .catch((error) => {
+    console.error("Error fetching or processing data:", error);
+  });
+
 function createAccordion(accordionId, headingId, headingText, parent) {
   const accordionDiv = document.createElement("div");
   accordionDiv.classList.add("accordion");